@@ -1,18 +1,30 @@
-import sys
-from internal.creation import BCMA
+import os
+import argparse
+from internal.creation import BCMA, ArcCache
 
-def do_creation(xml_name, out_name):
+def print_progress(done, total, message):
+    print(f"[{done}/{total}] {message}")
+
+def do_creation(xml_name, out_name, jobs=None, cache_dir=None, cache_size=None):
     with open(xml_name, "rb") as f:
-        bcma = BCMA(f)
+        # images stored as files are next to the XML
+        bcma = BCMA(f, os.path.dirname(xml_name))
+
+    cache = None
+    if cache_dir is not None:
+        cache = ArcCache(cache_dir) if cache_size is None else ArcCache(cache_dir, cache_size * 1024 * 1024)
 
     with open(out_name, "wb") as f:
-        bcma.write_to_file(f)
+        bcma.write_to_file(f, jobs, cache, print_progress)
 
     print("Complete")
 
 if __name__ == "__main__":
-    if len(sys.argv) == 3:
-        do_creation(sys.argv[1], sys.argv[2])
-    else:
-        print("Usage: {} <input .xml path> <output .bcma path>".format(sys.argv[0]))
-        sys.exit(0)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xml", help="input .xml path")
+    parser.add_argument("bcma", help="output .bcma path")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="build the region/language arcs in parallel with this many processes")
+    parser.add_argument("--cache", metavar="DIR", default=None, help="reuse compressed arcs from previous builds stored in this folder")
+    parser.add_argument("--cache-size", metavar="MB", type=int, default=None, help="size limit of the cache folder, least recently used arcs are removed past it (default 512)")
+    args = parser.parse_args()
+    do_creation(args.xml, args.bcma, args.jobs, args.cache, args.cache_size)
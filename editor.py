@@ -1,5 +1,6 @@
 import sys
 import os
+import tempfile
 from PySide2.QtWidgets import QApplication
 from PySide2.QtWidgets import QMainWindow
 from PySide2.QtWidgets import QHBoxLayout
@@ -10,10 +11,17 @@ from PySide2.QtWidgets import QTreeWidgetItem
 from PySide2.QtWidgets import QGraphicsScene
 from PySide2.QtWidgets import QGraphicsView
 from PySide2.QtWidgets import QDockWidget
+from PySide2.QtWidgets import QFileDialog
 from PySide2.QtGui import QStandardItem
 from PySide2.QtGui import QStandardItemModel
+from PySide2.QtGui import QIcon
 from PySide2.QtCore import Slot
 from PySide2.QtCore import Qt
+from PySide2.QtCore import QModelIndex
+from PySide2.QtCore import QThreadPool
+
+from internal.creation import Cancelled
+from internal.editor import TextureCache, ManualIndex, PageTreeModel, LayoutRenderer, Man3Project, Worker
 
 APP_VER_REV = 0
 APP_VER_MINOR = 0
@@ -69,6 +77,21 @@ class MyMainWindow(QMainWindow):
         super(MyMainWindow, self).__init__(parent)
         self.setWindowTitle(APP_FULL_NAME)
 
+        self.textures = TextureCache(parent=self)
+        self.textures.textureReady.connect(self.texture_ready)
+        self.textures.textureFailed.connect(self.texture_failed)
+        self.image_items = {}
+        self.images_worker = None
+        # the branches of the images dock whose thumbnails were asked for
+        self.expanded_images = set()
+        self.manual = None
+        self.pagesModel = None
+        # imports and exports run one at a time on their own pool, so they don't hold up the textures
+        self.jobs = QThreadPool(self)
+        self.jobs.setMaxThreadCount(1)
+        self.worker = None
+        self.worker_finished = None
+
         self.createMenus()
         self.createStatus()
         self.createContent()
@@ -78,9 +101,12 @@ class MyMainWindow(QMainWindow):
         bar = self.menuBar()
 
         fileMenu = bar.addMenu("File")
-        fileMenu.addAction("Save")  # save the opened project to a .man3 file
-        fileMenu.addAction("Open")  # open a .man3 file to edit further (it's a zip containing the xml for each region/lang, and the added images)
-        fileMenu.addAction("Export")  # generate the complete bcma xml from the shortened version and generate a BCMA from that
+        fileMenu.addAction("Save").triggered.connect(self.save_project)  # save the changes to the opened .man3 project
+        fileMenu.addAction("Open").triggered.connect(self.open_dialog)  # open a .man3 project, a .bcma, or a Manual XML to make a project of
+        fileMenu.addAction("Export").triggered.connect(self.export_dialog)  # build the .bcma of the project, or write its complete Manual XML for creator.py
+        self.cancelAction = fileMenu.addAction("Cancel")  # stop the running import or export
+        self.cancelAction.triggered.connect(self.cancel_worker)
+        self.cancelAction.setEnabled(False)
         fileMenu.addSeparator()
         fileMenu.addAction("Quit").triggered.connect(self.exit_app)
 
@@ -90,8 +116,9 @@ class MyMainWindow(QMainWindow):
     def createStatus(self):
         self.statusBar().showMessage("Welcome to {}".format(APP_FULL_NAME))
     def createContent(self):
-        # self.drawingScene = QGraphicsScene()
-        self.drawingArea = QGraphicsView()
+        self.drawingScene = QGraphicsScene()
+        self.renderer = LayoutRenderer(self.drawingScene, self.textures, self.texture_data, parent=self)
+        self.drawingArea = QGraphicsView(self.drawingScene)
         self.drawingArea.setSizePolicy(QSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding))
         self.setCentralWidget(self.drawingArea)
 
@@ -105,17 +132,17 @@ class MyMainWindow(QMainWindow):
         self.imagesList.setSizePolicy(pol)
         self.pagesTree.setSizePolicy(pol)
 
-        self.added_images = {"Common": {}}
+        self.added_images = {}
         self.imagesModel = QStandardItemModel()
         rootItem = self.imagesModel.invisibleRootItem()
-        rootItem.appendRow(QStandardItem("Common"))
-        for lang in LangInfo.LONG_TO_SHORT.keys():
+        for lang in ("Common", *LangInfo.LONG_TO_SHORT.keys()):
             branchWidget = QStandardItem(lang)
             branchWidget.setEditable(False)
             self.added_images[lang] = (branchWidget, {})
             rootItem.appendRow(branchWidget)
         self.imagesList.setModel(self.imagesModel)
         self.imagesList.setHeaderHidden(True)
+        self.imagesList.expanded.connect(self.images_expanded)
 
         self.pagesTree.setSortingEnabled(False) 
 
@@ -142,14 +169,229 @@ class MyMainWindow(QMainWindow):
         dock.setWidget(self.pagesTree)
         self.addDockWidget(Qt.LeftDockWidgetArea, dock)
 
+    def openManual(self, path):
+        # only the table of the bcma or the index of the project is read here, the tree loads the rest as it gets expanded
+        if self.worker is not None:
+            self.statusBar().showMessage("Wait for the current task to finish, or cancel it")
+            return
+        ext = os.path.splitext(path)[1].lower()
+        if self.manual is not None:
+            self.manual.close()
+        if ext == ".man3":
+            self.manual = Man3Project(path)
+        elif ext == ".xml":
+            project_path, _ = QFileDialog.getSaveFileName(self, "Save the project as", os.path.splitext(path)[0] + ".man3", "Projects (*.man3)")
+            if not project_path:
+                return
+            # a whole manual takes a while to split, it's shown once done
+            self.run_worker(Worker(import_project, path, project_path), lambda project: self.showManual(project, project_path))
+            return
+        else:
+            with open(path, "rb") as f:
+                self.manual = ManualIndex.from_file(f)
+        self.showManual(self.manual, path)
+
+    def showManual(self, manual, path):
+        self.manual = manual
+        self.renderer.reset()
+        self.showImages()
+        self.pagesModel = PageTreeModel(self.manual, LangInfo.REGIONS, parent=self)
+        self.pagesTree.setModel(self.pagesModel)
+        self.pagesTree.setHeaderHidden(True)
+        self.pagesTree.selectionModel().currentChanged.connect(self.page_selected)
+        self.statusBar().showMessage("Opened {}".format(path))
+
+    @Slot()
+    def open_dialog(self, checked):
+        path, _ = QFileDialog.getOpenFileName(self, "Open", "", "Manuals (*.man3 *.bcma *.xml)")
+        if path:
+            self.openManual(path)
+
+    @Slot()
+    def save_project(self, checked):
+        if not isinstance(self.manual, Man3Project):
+            self.statusBar().showMessage("Only projects can be saved, open the Manual XML to make one")
+            return
+        if self.worker is not None:
+            self.statusBar().showMessage("Wait for the current task to finish, or cancel it")
+            return
+        self.manual.save()
+        self.statusBar().showMessage("Saved {}".format(self.manual.path))
+
+    @Slot()
+    def export_dialog(self, checked):
+        if not isinstance(self.manual, Man3Project):
+            self.statusBar().showMessage("Only projects can be exported")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export", "", "Manual (*.bcma);;Manual XML (*.xml)")
+        if not path:
+            return
+        if os.path.splitext(path)[1].lower() == ".xml":
+            worker = Worker(self.manual.export_manual, path)
+        else:
+            worker = Worker(self.manual.build_bcma, path)
+        self.run_worker(worker, lambda result: self.statusBar().showMessage("Exported {}".format(path)))
+
+    def run_worker(self, worker, finished):
+        if self.worker is not None:
+            self.statusBar().showMessage("Wait for the current task to finish, or cancel it")
+            return
+        # the signals come from the pool thread, connecting them to slots of the window makes them run on the GUI thread
+        self.worker = worker
+        self.worker_finished = finished
+        worker.signals.progress.connect(self.worker_progress)
+        worker.signals.finished.connect(self.worker_done)
+        worker.signals.failed.connect(self.worker_failed)
+        worker.signals.cancelled.connect(self.worker_cancelled)
+        self.cancelAction.setEnabled(True)
+        self.jobs.start(worker)
+
+    @Slot()
+    def cancel_worker(self, checked):
+        if self.worker is not None:
+            self.worker.cancel()
+
+    @Slot(int, int, str)
+    def worker_progress(self, done, total, message):
+        self.statusBar().showMessage("[{}/{}] {}".format(done, total, message))
+
+    def worker_ended(self):
+        finished = self.worker_finished
+        self.worker = None
+        self.worker_finished = None
+        self.cancelAction.setEnabled(False)
+        return finished
+
+    @Slot(object)
+    def worker_done(self, result):
+        self.worker_ended()(result)
+
+    @Slot(str)
+    def worker_failed(self, message):
+        self.worker_ended()
+        self.statusBar().showMessage("Failed: {}".format(message))
+
+    @Slot()
+    def worker_cancelled(self):
+        self.worker_ended()
+        self.statusBar().showMessage("Cancelled")
+
+    @Slot(QModelIndex, QModelIndex)
+    def page_selected(self, current, previous):
+        layout = self.pagesModel.layout(current)
+        if layout is not None:
+            region, lang = self.pagesModel.language(current)
+            self.renderer.show(layout, region, lang)
+            self.statusBar().showMessage("{}: {} sections".format(self.pagesModel.data(current), layout.sections_count))
+
+    def texture_data(self, name, region=None, lang=None):
+        return None if self.manual is None else self.manual.texture(name, region, lang)
+
+    def showImages(self):
+        self.image_items.clear()
+        self.expanded_images.clear()
+        for branchWidget, images in self.added_images.values():
+            branchWidget.removeRows(0, branchWidget.rowCount())
+            images.clear()
+        if self.images_worker is not None:
+            self.images_worker.cancel()
+        # listing the images of a bcma decompresses its image arcs, so it's done on the pool
+        self.images_worker = Worker(list_images, self.manual)
+        self.images_worker.signals.finished.connect(self.images_listed)
+        QThreadPool.globalInstance().start(self.images_worker)
+
+    @Slot(object)
+    def images_listed(self, result):
+        manual, arcs = result
+        if manual is not self.manual:
+            return
+        self.images_worker = None
+        short_to_long = {short: long for long, short in LangInfo.LONG_TO_SHORT.items()}
+        # the arcs are Common_texture and <region>_<lang>_image
+        for arc_name, names in arcs:
+            parts = arc_name.split("_")
+            lang = "Common" if parts[0] == "Common" else short_to_long.get(parts[1] if len(parts) > 1 else "")
+            if lang is None:
+                continue
+            for name in names:
+                self.addImage(lang, arc_name, name)
+
+    @Slot(QModelIndex)
+    def images_expanded(self, index):
+        # thumbnails are only made for the branches that get looked at
+        lang = self.imagesModel.itemFromIndex(index).text()
+        if lang not in self.added_images or lang in self.expanded_images:
+            return
+        self.expanded_images.add(lang)
+        for (arc_name, name), item in self.added_images[lang][1].items():
+            self.request_thumbnail(item, arc_name, name)
+
+    def addImage(self, lang, arc_name, name):
+        branchWidget, images = self.added_images[lang]
+        item = QStandardItem(name)
+        item.setEditable(False)
+        branchWidget.appendRow(item)
+        images[arc_name, name] = item
+        if lang in self.expanded_images:
+            self.request_thumbnail(item, arc_name, name)
+
+    def request_thumbnail(self, item, arc_name, name):
+        # shown as soon as the texture cache has it
+        data = self.manual.image(arc_name, name)
+        if data is None:
+            return
+        key, ready = self.textures.request(name, data)
+        self.image_items.setdefault(key, []).append(item)
+        if ready:
+            self.texture_ready(name, key)
+
+    @Slot(str, object)
+    def texture_ready(self, name, key):
+        thumbnail = self.textures.thumbnail(key)
+        if thumbnail is None:
+            return
+        for item in self.image_items.get(key, ()):
+            item.setIcon(QIcon(thumbnail))
+
+    @Slot(str, str)
+    def texture_failed(self, name, message):
+        self.statusBar().showMessage("Could not decode {}: {}".format(name, message))
+
     @Slot()
     def exit_app(self, checked):
         QApplication.quit()
 
+def list_images(manual, progress=None, cancelled=None):
+    arcs = []
+    for arc_name in manual.image_arc_names():
+        if cancelled is not None and cancelled():
+            raise Cancelled()
+        arcs.append((arc_name, manual.image_names(arc_name)))
+    return manual, arcs
+
+def import_project(path, project_path, progress=None, cancelled=None):
+    # made from scratch next to where it goes, it only replaces what is there once complete
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(project_path)), suffix=".man3")
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        project = Man3Project(tmp)
+        with open(path, "rb") as f:
+            project.import_manual(f, os.path.dirname(path), progress, cancelled)
+        project.save()
+        project.close()
+        os.replace(tmp, project_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return Man3Project(project_path)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
 
     mainwindow = MyMainWindow()
     mainwindow.show()
+    if len(sys.argv) > 1:
+        mainwindow.openManual(sys.argv[1])
 
     sys.exit(app.exec_())
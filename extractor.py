@@ -1,65 +1,207 @@
 import os
-import sys
+import mmap
+import argparse
+import functools
 import contextlib
+from concurrent.futures import ProcessPoolExecutor
 
 from lxml import etree
 from lxml.builder import E as GenXML
 
-from internal import lzss3_dec, extraction, my_rle
+from internal import lzss3_dec, extraction, image_storage
 
-def do_arc(fn, outfolder):
+@contextlib.contextmanager
+def mapped(fn):
+    # map the file read-only, and unmap it once done. if something went wrong, the traceback may still hold views
+    # of the map: closing it would raise a BufferError hiding the actual error, so it is left to be freed with them
     with open(fn, "rb") as f:
-        data = f.read()
-        try:
-            newdata = lzss3_dec.decompress_bytes(data)
-            print("DARC was LZ compressed")
-            data = newdata
-        except lzss3_dec.DecompressionError:
-            pass
-        mainarc = extraction.DARC(data)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    yield data
+    data.close()
+
+def extract_darc(data, outfolder, write_arcs=True, log=print, extract_nested=None):
+    if extract_nested is None:
+        extract_nested = lambda nested_data, nested_folder: extract_darc(nested_data, nested_folder, write_arcs, log)
 
-    for k, v in mainarc.data.files.items():
+    try:
+        newdata = lzss3_dec.decompress_bytes(data)
+        log("DARC was LZ compressed")
+        data = newdata
+    except lzss3_dec.DecompressionError:
+        pass
+    arc = extraction.LazyDARC(data)
+
+    for k, v in arc.data.files.items():
         p = os.path.join(outfolder, k)
-        print("File path:", p)
-        os.makedirs(os.path.dirname(p), exist_ok=True)
-        with open(p, "wb") as f:
-            f.write(v)
-        if k.endswith(".arc"):
-            do_arc(p, os.path.join(outfolder, os.path.splitext(k)[0]))
+        log("File path:", p)
+        is_arc = k.endswith(".arc")
+        if write_arcs or not is_arc:
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+            with open(p, "wb") as f:
+                f.write(v)
+        if is_arc:
+            # nested arcs are unpacked straight from memory, never read back from disk
+            extract_nested(v, os.path.join(outfolder, os.path.splitext(k)[0]))
         # elif k.endswith(".bclim"):
-        #     with open(os.path.join(outfolder, k), "rb") as f:
-        #         extraction.BCLIM(f.read())
+        #     extraction.BCLIM(v)
+
+def extract_nested_arc(data, outfolder, write_arcs):
+    # runs in a worker process for --jobs, returns the lines it would have printed
+    lines = []
+    extract_darc(data, outfolder, write_arcs, lambda *args: lines.append(" ".join(map(str, args))))
+    return lines
+
+def do_arc(fn, outfolder, write_arcs=True, jobs=None):
+    # map the file rather than reading it, only the parts that get written out are ever loaded
+    with mapped(fn) as data:
+        if jobs is None:
+            extract_darc(data, outfolder, write_arcs)
+            return
+
+        # the arcs inside the main one are unpacked by the workers,
+        # the output is kept in order so it reads the same as in serial mode
+        output = []
+        with ProcessPoolExecutor(jobs) as pool:
+            def log(*args):
+                output.append(" ".join(map(str, args)))
+            def extract_nested(nested_data, nested_folder):
+                output.append(pool.submit(extract_nested_arc, bytes(nested_data), nested_folder, write_arcs))
+
+            extract_darc(data, outfolder, write_arcs, log, extract_nested)
+            for item in output:
+                if type(item) is str:
+                    print(item)
+                else:
+                    for line in item.result():
+                        print(line)
 
 def do_single_bclyt(filepath, savepos):
     with open(filepath, "rb") as f:
         extraction.BCLYT(f.read()).to_xml().getroottree().write(savepos, pretty_print=True, xml_declaration=True, encoding='utf-8')
 
-def do_bclyt(name, savepos):
-    regions = ["EUR", "USA", "CHN", "TWN", "JPN", "KOR"]
-    types = ["small", "large", "index", "BcmaInfo"]
-    images = {}
-    langs = {
-        "EUR": ["fr", "en", "ru", "pt", "nl", "es", "it", "de"],
-        "USA": ["en", "es", "fr"],
-        "JPN": ["ja"],
-        "TWN": ["tc"],
-        "CHN": ["sc"],
-        "KOR": ["ko"],
-    }
-    indexes = {r: {l: None for l in langs[r]} for r in regions}
-    pages = {r: {l: {} for l in langs[r]} for r in regions}
-    bcmainfo = etree.Element("BcmaInfo")
+REGIONS = ["EUR", "USA", "CHN", "TWN", "JPN", "KOR"]
+LANGS = {
+    "EUR": ["fr", "en", "ru", "pt", "nl", "es", "it", "de"],
+    "USA": ["en", "es", "fr"],
+    "JPN": ["ja"],
+    "TWN": ["tc"],
+    "CHN": ["sc"],
+    "KOR": ["ko"],
+}
+LAYOUT_TYPES = ["small", "large", "index", "BcmaInfo"]
+
+class Manual:
+    # collects where the images and layouts of a manual are, then streams them out as the Manual XML.
+    # each one is only loaded when its turn to be written comes, and dropped right after
+    def __init__(self, image_mode="rle"):
+        self.image_mode = image_mode
+        self.images = {}
+        self.indexes = {r: {l: None for l in LANGS[r]} for r in REGIONS}
+        self.pages = {r: {l: {} for l in LANGS[r]} for r in REGIONS}
+        self.bcmainfo = []
+
+    def add_image(self, arcname, imgname, load):
+        i = self.images.get(arcname, {})
+        i[imgname] = load
+        if len(i) == 1:
+            self.images[arcname] = i
+
+    def add_layout(self, typ, reg, lng, filename, load):
+        if typ == "BcmaInfo":
+            self.bcmainfo.append(load)
+        elif typ == "index":
+            self.indexes[reg][lng] = load
+        else:
+            page = filename[5:8]
+            sub_page = filename.split("_")[-1].split(".")[0]
+            p = self.pages[reg][lng].get(page, {})
+            p[typ, sub_page] = load
+            if len(p) == 1:
+                self.pages[reg][lng][page] = p
+
+    def write(self, savepos):
+        # laid out the same as a pretty printed tree would be, xmlfile only writes inside the root element
+        with open(savepos, "wb") as f:
+            f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            with etree.xmlfile(f, encoding='utf-8') as xf, xf.element("Manual"):
+                with write_parent(xf, 1, "ImageArcs", len(self.images)):
+                    for arc, imgs in self.images.items():
+                        with write_parent(xf, 2, "ImageArc", len(imgs), name=arc):
+                            for imgname, load in imgs.items():
+                                self.write_image(xf, savepos, arc, imgname, load())
+                with write_parent(xf, 1, "BcmaInfo", len(self.bcmainfo)):
+                    for load in self.bcmainfo:
+                        write_child(xf, 2, load())
+                for r in REGIONS:
+                    langs = [l for l in LANGS[r] if self.indexes[r][l] is not None]
+                    if not len(langs):
+                        continue
+                    with write_parent(xf, 1, "Region", len(langs), region=r):
+                        for l in langs:
+                            with write_parent(xf, 2, "Pages", 1, lang=l):
+                                write_child(xf, 3, GenXML.Index(self.indexes[r][l]()))
+                                for pnumber, v in self.pages[r][l].items():
+                                    with write_parent(xf, 3, "Page", len(v), page=str(pnumber)):
+                                        for (ptype, subpnum), load in v.items():
+                                            write_child(xf, 4, GenXML.SubPage(load(), pagesize=ptype, subpage=subpnum))
+                xf.write("\n")
+            f.write(b"\n")
+
+    def write_image(self, xf, savepos, arc, imgname, data):
+        if self.image_mode == "files":
+            # the images go in a folder named after the XML, next to it
+            path = os.path.join(os.path.splitext(os.path.basename(savepos))[0] + "_images", arc, imgname + ".bclim")
+            fullpath = os.path.join(os.path.dirname(savepos), path)
+            os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+            with open(fullpath, "wb") as f:
+                f.write(data)
+            write_child(xf, 3, etree.Element("Image", name=imgname, file=path.replace(os.sep, "/")))
+        else:
+            if self.image_mode == "zlib":
+                attrs = {"name": imgname, "encoding": "zlib"}
+                pieces = image_storage.zlib_encode(data)
+            else:
+                attrs = {"name": imgname}
+                pieces = image_storage.rle_encode(data)
+            # the text goes out as it is encoded, it is never whole in memory
+            xf.write("\n" + "  " * 3)
+            with xf.element("Image", attrs):
+                for text in pieces:
+                    xf.write(text)
+
+def write_child(xf, depth, element):
+    xf.write("\n" + "  " * depth)
+    etree.indent(element, level=depth)
+    xf.write(element)
+
+@contextlib.contextmanager
+def write_parent(xf, depth, tag, children, **attrs):
+    if not children:
+        write_child(xf, depth, etree.Element(tag, attrs))
+        yield
+        return
+    xf.write("\n" + "  " * depth)
+    with xf.element(tag, attrs):
+        yield
+        xf.write("\n" + "  " * depth)
+
+def load_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def load_layout(label, load):
+    print(label)
+    return extraction.BCLYT(load()).to_xml()
+
+def do_bclyt(name, savepos, image_mode="rle"):
+    manual = Manual(image_mode)
 
     for root, dirs, files in os.walk(name):
         for filename in files:
             if filename.endswith(".bclim"):
                 arcname = os.path.split(os.path.split(root)[0])[1]
-                i = images.get(arcname, {})
                 fullpath = os.path.join(root, filename)
-                with open(fullpath, "rb") as f:
-                    i[os.path.splitext(filename)[0]] = my_rle.do_compression(f.read().hex())
-                if len(i) == 1:
-                    images[arcname] = i
+                manual.add_image(arcname, os.path.splitext(filename)[0], functools.partial(load_file, fullpath))
             elif not filename.endswith(".bclyt"):
                 continue
 
@@ -67,7 +209,7 @@ def do_bclyt(name, savepos):
             # print(fullpath)
 
             typ = None
-            for t in types:
+            for t in LAYOUT_TYPES:
                 if t in root:
                     typ = t
                     break
@@ -77,7 +219,7 @@ def do_bclyt(name, savepos):
             reg = None
             lng = None
             if typ != "BcmaInfo":
-                for r in regions:
+                for r in REGIONS:
                     if r + "_" in root:
                         reg = r
                         break
@@ -85,7 +227,7 @@ def do_bclyt(name, savepos):
                     print("Unknown region for", root)
                     continue
 
-                for l in langs[reg]:
+                for l in LANGS[reg]:
                     if "_" + l + "_" in root:
                         lng = l
                         break
@@ -93,66 +235,107 @@ def do_bclyt(name, savepos):
                     print("Unknown language for", root)
                     continue
 
-            page = None
-            sub_page = None
-            if typ != "BcmaInfo" and typ != "index":
-                page = filename[5:8]
-                sub_page = filename.split("_")[-1].split(".")[0]
-
-            with open(fullpath, "rb") as f:
-                print(fullpath)
-                x = extraction.BCLYT(f.read()).to_xml()
-                if typ == "BcmaInfo":
-                    bcmainfo.append(x.getroottree().getroot())
-                elif typ == "index":
-                    indexes[reg][lng] = GenXML.Index(x)
-                else:
-                    p = pages[reg][lng].get(page, {})
-                    p[typ, sub_page] = x
-                    if len(p) == 1:
-                        pages[reg][lng][page] = p
-
-    root = etree.Element("Manual")
-    image_arcs = []
-    for arc, imgs in images.items():
-        imgs_x = []
-        for imgname, imgdata in imgs.items():
-            imgs_x.append(GenXML.Image(imgdata, name=imgname))
-        image_arcs.append(GenXML.ImageArc(*imgs_x, name=arc))
-    root.append(GenXML.ImageArcs(*image_arcs).getroottree().getroot())
-    root.append(bcmainfo)
-    for r in regions:
-        langs_x = []
-        for l in langs[r]:
-            idx = indexes[r][l]
-            if idx is not None:
-                ps = [idx]
-                for pnumber, v in pages[r][l].items():
-                    ps_i = []
-                    for (ptype, subpnum), v2 in v.items():
-                        ps_i.append(GenXML.SubPage(v2, pagesize=ptype, subpage=subpnum))
-                    ps.append(GenXML.Page(*ps_i, page=str(pnumber)))
-                if len(ps):
-                    langs_x.append(GenXML.Pages(*ps, lang=l))
-        if len(langs_x):
-            root.append(GenXML.Region(*langs_x, region=r).getroottree().getroot())
-    etree.ElementTree(root).write(savepos, pretty_print=True, xml_declaration=True, encoding='utf-8')
+            manual.add_layout(typ, reg, lng, filename, functools.partial(load_layout, fullpath, functools.partial(load_file, fullpath)))
+
+    manual.write(savepos)
+
+def parse_arc_name(arcname):
+    # inner arcs are named BcmaInfo or <region>_<lang>_<small|large|index>, anything else only holds images
+    if arcname == "BcmaInfo":
+        return "BcmaInfo", None, None
+    parts = arcname.split("_")
+    if len(parts) == 3 and parts[2] in LAYOUT_TYPES:
+        return parts[2], parts[0], parts[1]
+    return None, None, None
+
+class InnerArcs:
+    # the arcs inside a bcma, decompressed when their files are needed. only the last few are kept,
+    # enough for the index, large and small arcs of the language being written
+    def __init__(self, data, keep=3):
+        try:
+            newdata = lzss3_dec.decompress_bytes(data)
+            print("DARC was LZ compressed")
+            data = newdata
+        except lzss3_dec.DecompressionError:
+            pass
+        self.mainarc = extraction.LazyDARC(data)
+        self.open = functools.lru_cache(maxsize=keep)(self.decompress)
+
+    def decompress(self, k):
+        v = self.mainarc.get(k)
+        try:
+            v = lzss3_dec.decompress_bytes(v)
+        except lzss3_dec.DecompressionError:
+            pass
+        return extraction.LazyDARC(v)
+
+    def names(self):
+        return list(self.mainarc.names())
+
+    def files(self, k):
+        return list(self.open(k).names())
+
+    def load(self, k, name):
+        return self.open(k).get(name)
+
+    def close(self):
+        # drops every view of the data, so it can be unmapped
+        self.open.cache_clear()
+        self.mainarc = None
+
+def do_bcma(fn, savepos, image_mode="rle"):
+    with mapped(fn) as data:
+        arcs = InnerArcs(data)
+        try:
+            manual = Manual(image_mode)
+            for k in arcs.names():
+                arcname, ext = os.path.splitext(os.path.basename(k))
+                if ext != ".arc":
+                    continue
+
+                typ, reg, lng = parse_arc_name(arcname)
+                if typ is not None and typ != "BcmaInfo":
+                    if reg not in LANGS:
+                        print("Unknown region for", arcname)
+                        continue
+                    if lng not in LANGS[reg]:
+                        print("Unknown language for", arcname)
+                        continue
+
+                # the arc is decompressed again when its files are written, rather than all of them staying in memory until then
+                for name in arcs.files(k):
+                    filename = os.path.basename(name)
+                    load = functools.partial(arcs.load, k, name)
+                    if filename.endswith(".bclim"):
+                        manual.add_image(arcname, os.path.splitext(filename)[0], load)
+                    elif filename.endswith(".bclyt") and typ is not None:
+                        manual.add_layout(typ, reg, lng, filename, functools.partial(load_layout, os.path.join(arcname, name), load))
+
+            manual.write(savepos)
+        finally:
+            arcs.close()
 
 if __name__ == "__main__":
     handlers = {
         "arc": do_arc,
         "bclyt": do_bclyt,
+        "bcma": do_bcma,
         "single": do_single_bclyt,
     }
 
-    if len(sys.argv) == 4:
-        try:
-            h = handlers[sys.argv[1]]
-        except KeyError:
-            print("Unkown action:", sys.argv[1])
-        else:
-            h(sys.argv[2], sys.argv[3])
-            print("Complete")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=list(handlers))
+    parser.add_argument("input", help="input path")
+    parser.add_argument("output", help="output path")
+    parser.add_argument("--leaves-only", action="store_true", help="arc: only write the files inside nested .arc files, not the .arc files themselves")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="arc: decompress and unpack the nested .arc files with this many processes")
+    parser.add_argument("--images", choices=image_storage.MODES, default="rle", help="bclyt/bcma: store the images as hex RLE text (default), as base64 of zlib data, or as files next to the XML")
+    args = parser.parse_args()
+
+    if args.action == "arc":
+        do_arc(args.input, args.output, not args.leaves_only, args.jobs)
+    elif args.action in ("bclyt", "bcma"):
+        handlers[args.action](args.input, args.output, args.images)
     else:
-        print("Usage: {} <{}> <input path> <output path>".format(sys.argv[0], "|".join(map(str, handlers))))
-        sys.exit(0)
+        handlers[args.action](args.input, args.output)
+    print("Complete")
@@ -1,3 +1,5 @@
-from .bcma import BCMA
+from .bcma import BCMA, Cancelled
+from .arccache import ArcCache
+from .bclim import BCLIM
 
-__all__ = ("BCMA")
\ No newline at end of file
+__all__ = ("BCMA", "Cancelled", "ArcCache", "BCLIM")
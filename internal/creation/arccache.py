@@ -0,0 +1,78 @@
+import os
+import hashlib
+import tempfile
+
+from nlzss3 import compress
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+class ArcCache:
+    """On-disk cache of compressed arcs, keyed by the hash of the uncompressed DARC.
+    Least recently used entries are evicted once the folder grows past max_size bytes."""
+
+    def __init__(self, folder, max_size=DEFAULT_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, data):
+        # the prefix changes the keys if the compressed format ever does
+        h = hashlib.sha256(b"lz10")
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + ".lz")
+
+    def get(self, key):
+        p = self.path(key)
+        try:
+            with open(p, "rb") as f:
+                compressed = f.read()
+        except FileNotFoundError:
+            return None
+        # the modification time is what eviction orders by
+        os.utime(p)
+        return compressed
+
+    def put(self, key, compressed):
+        # write then rename, so other processes never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp, self.path(key))
+
+    def compress(self, data, key=None):
+        if key is None:
+            key = self.key(data)
+        compressed = self.get(key)
+        if compressed is None:
+            compressed = self.compress_missing(data, key)
+        return compressed
+
+    def compress_missing(self, data, key):
+        # for when get(key) already came back empty
+        compressed = compress(data)
+        self.put(key, compressed)
+        return compressed
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.endswith(".lz"):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, p in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,172 @@
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from internal import usefulenums
+from internal.extraction.bclim import ETC1_MODIFIERS, morton_order
+
+# blocks given to each worker at once when encoding ETC1 in parallel
+ETC1_CHUNK_BLOCKS = 0x400
+
+def quantize(values, bits):
+    # 0-255 to a bits wide channel, rounding to the nearest
+    return (values.astype(np.uint32) * ((1 << bits) - 1) + 127) // 255
+
+def luminance(pixels):
+    return ((pixels[:, 0].astype(np.uint32) * 299 + pixels[:, 1].astype(np.uint32) * 587 + pixels[:, 2].astype(np.uint32) * 114 + 500) // 1000).astype(np.uint8)
+
+def pack_pixels(pixels, fmt):
+    """Raw data of the (count, 4) RGBA pixels in storage order, for every format but the ETC1 ones."""
+    F = usefulenums.ImageFormats
+    if fmt in (F.L4, F.A4):
+        values = quantize(luminance(pixels) if fmt == F.L4 else pixels[:, 3], 4).astype(np.uint8)
+        # the low nibble is the first pixel
+        return (values[0::2] | (values[1::2] << 4)).tobytes()
+    if fmt == F.RGBA8:
+        out = pixels[:, ::-1]
+    elif fmt == F.RGB8:
+        out = pixels[:, 2::-1]
+    elif fmt == F.L8:
+        out = luminance(pixels)
+    elif fmt == F.A8:
+        out = pixels[:, 3]
+    elif fmt == F.LA8:
+        out = np.stack((pixels[:, 3], luminance(pixels)), axis=-1)
+    elif fmt == F.HILO8:
+        out = pixels[:, 1::-1]
+    elif fmt == F.LA4:
+        out = ((quantize(luminance(pixels), 4) << 4) | quantize(pixels[:, 3], 4)).astype(np.uint8)
+    else:
+        if fmt == F.RGB565:
+            v = (quantize(pixels[:, 0], 5) << 11) | (quantize(pixels[:, 1], 6) << 5) | quantize(pixels[:, 2], 5)
+        elif fmt == F.RGB5A1:
+            v = (quantize(pixels[:, 0], 5) << 11) | (quantize(pixels[:, 1], 5) << 6) | (quantize(pixels[:, 2], 5) << 1) | (pixels[:, 3] >= 0x80)
+        elif fmt == F.RGBA4:
+            v = (quantize(pixels[:, 0], 4) << 12) | (quantize(pixels[:, 1], 4) << 8) | (quantize(pixels[:, 2], 4) << 4) | quantize(pixels[:, 3], 4)
+        else:
+            raise ValueError(f"Unsupported image format: {fmt}")
+        out = v.astype("<u2")
+    return np.ascontiguousarray(out).tobytes()
+
+def fit_tables(sub_pixels, base):
+    """For the (count, 2, 8, 3) pixels of the two halves of each block and their (count, 2, 3) base colors,
+    finds the modifier table giving the least error. Returns the errors and tables (count, 2) and the pixel indexes (count, 2, 8)."""
+    modifiers = np.array(ETC1_MODIFIERS, dtype=np.int32)
+    # (count, 2, table, modifier, 3)
+    colors = np.clip(base[:, :, None, None, :] + modifiers[None, None, :, :, None], 0, 255)
+    # (count, 2, table, modifier, pixel)
+    errors = ((sub_pixels[:, :, None, None, :, :] - colors[:, :, :, :, None, :]) ** 2).sum(axis=-1)
+    indexes = errors.argmin(axis=3)
+    table_errors = errors.min(axis=3).sum(axis=-1)
+    tables = table_errors.argmin(axis=-1)
+    pick = tables[:, :, None, None]
+    return np.take_along_axis(table_errors, tables[:, :, None], -1)[:, :, 0], tables, np.take_along_axis(indexes, pick, 2)[:, :, 0]
+
+def encode_etc1_blocks(pixels):
+    """64-bit words of the ETC1 blocks of the (count, 16, 3) pixels, in the order of the pixel indexes (x * 4 + y).
+    Both ways of splitting each block and both color modes are tried, the one with the least error is kept."""
+    pixels = pixels.astype(np.int32)
+    count = len(pixels)
+    px = np.arange(16) // 4
+    py = np.arange(16) % 4
+
+    best_error = np.full(count, np.inf)
+    best_word = np.zeros(count, dtype=np.uint64)
+    for flip in (0, 1):
+        second = (py >= 2) if flip else (px >= 2)
+        halves = (np.flatnonzero(~second), np.flatnonzero(second))
+        sub_pixels = np.stack([pixels[:, h] for h in halves], axis=1)
+        average = sub_pixels.mean(axis=2)
+
+        individual = np.clip(np.rint(average / 17), 0, 15).astype(np.int32)
+        five_bits = np.clip(np.rint(average * 31 / 255), 0, 31).astype(np.int32)
+        delta = five_bits[:, 1] - five_bits[:, 0]
+        differential_ok = np.all((delta >= -4) & (delta <= 3), axis=-1)
+
+        for differential in (0, 1):
+            if differential:
+                base = (five_bits << 3) | (five_bits >> 2)
+            else:
+                base = individual * 17
+            errors, tables, indexes = fit_tables(sub_pixels, base)
+            error = errors.sum(axis=-1).astype(np.float64)
+            if differential:
+                error[~differential_ok] = np.inf
+
+            word = np.zeros(count, dtype=np.uint64)
+            for channel, shift in enumerate((59, 51, 43)):
+                if differential:
+                    word |= five_bits[:, 0, channel].astype(np.uint64) << np.uint64(shift)
+                    word |= (delta[:, channel] & 7).astype(np.uint64) << np.uint64(shift - 3)
+                else:
+                    word |= individual[:, 0, channel].astype(np.uint64) << np.uint64(shift + 1)
+                    word |= individual[:, 1, channel].astype(np.uint64) << np.uint64(shift - 3)
+            word |= tables[:, 0].astype(np.uint64) << np.uint64(37)
+            word |= tables[:, 1].astype(np.uint64) << np.uint64(34)
+            word |= np.uint64(differential << 33 | flip << 32)
+            for half, pixel_indexes in enumerate(halves):
+                for j, p in enumerate(pixel_indexes):
+                    index = indexes[:, half, j].astype(np.uint64)
+                    word |= (index >> np.uint64(1)) << np.uint64(p + 16)
+                    word |= (index & np.uint64(1)) << np.uint64(p)
+
+            better = error < best_error
+            best_error[better] = error[better]
+            best_word[better] = word[better]
+    return best_word
+
+def encode_etc1(image, alpha, jobs=None):
+    """Raw ETC1(A4) data of the (height, width, 4) image, in the stored orientation.
+    With jobs set, the blocks are compressed by that many worker processes."""
+    height, width = image.shape[:2]
+    count = (width // 4) * (height // 4)
+    # the tiles are row major, the 4 blocks of each 8x8 tile in Z order, the pixels of a block column major
+    blocks = image.reshape(height // 8, 2, 4, width // 8, 2, 4, 4).transpose(0, 3, 1, 4, 5, 2, 6).reshape(count, 16, 4)
+
+    chunks = [blocks[i:i+ETC1_CHUNK_BLOCKS, :, 0:3] for i in range(0, count, ETC1_CHUNK_BLOCKS)]
+    if jobs is None:
+        words = list(map(encode_etc1_blocks, chunks))
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            words = list(pool.map(encode_etc1_blocks, chunks))
+    colors = np.concatenate(words).astype("<u8")
+
+    if not alpha:
+        return colors.tobytes()
+    nibbles = quantize(blocks[:, :, 3], 4).astype(np.uint64)
+    alphas = np.bitwise_or.reduce(nibbles << (np.arange(16, dtype=np.uint64) * np.uint64(4)), axis=1).astype("<u8")
+    return np.stack((alphas, colors), axis=1).tobytes()
+
+def encode(image, fmt, jobs=None):
+    """Raw texture data of the (height, width, 4) uint8 RGBA image, top row first, in format fmt (an ImageFormats).
+    The texture is padded to powers of 2 like the decoder expects."""
+    if np is None:
+        raise ImportError("encoding textures requires numpy")
+    fmt = usefulenums.ImageFormats(fmt)
+    height, width = image.shape[:2]
+    w, h = [max(8, 1 << (x - 1).bit_length()) for x in (width, height)]
+    padded = np.zeros((h, w, 4), dtype=np.uint8)
+    padded[:height, :width] = image
+    # the first stored row is the bottom one
+    stored = padded[::-1]
+    if fmt in (usefulenums.ImageFormats.ETC1, usefulenums.ImageFormats.ETC1A4):
+        return encode_etc1(stored, fmt == usefulenums.ImageFormats.ETC1A4, jobs)
+    pixels = stored.reshape(w * h, 4)[morton_order(w, h)]
+    return pack_pixels(pixels, fmt)
+
+class BCLIM:
+    def __init__(self, image, fmt, jobs=None):
+        self.height, self.width = image.shape[:2]
+        self.format = usefulenums.ImageFormats(fmt)
+        self.data = encode(image, self.format, jobs)
+
+    def write_to_file(self, out):
+        footer_size = 0x28
+        revision = 0x2020000
+        out.write(self.data)
+        out.write(struct.pack("<4s2H2I2H", b"CLIM", 0xfeff, 0x14, revision, len(self.data) + footer_size, 1, 0))
+        out.write(struct.pack("<4sI2HII", b"imag", 0x10, self.width, self.height, self.format.value, len(self.data)))
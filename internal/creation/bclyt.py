@@ -5,8 +5,6 @@ from dataclasses import dataclass
 
 from internal import usefulenums
 
-USD_TYPE_OVERRIDE = 1
-
 class Writable:
     def __init__(self, out=None):
         if out is None:
@@ -30,21 +28,25 @@ class Writable:
     def asbytes(self):
         return self.fobj.getvalue()
 
-class RGBA:
-    MAPPED_COLORS = {}
+class BuildContext:
+    """State of the build of one layout, so that several can be built at once.
+    usd_type is how the userdata names are laid out: 1 after each entry, 2 all at the end,
+    -1 picks per entry like the info pages do."""
+
+    def __init__(self, usd_type=1):
+        self.usd_type = usd_type
+        self.colors = {}
 
-    @staticmethod
-    def add_from_color(color):
+    def add_color(self, color):
         assert(color.tag == "Color")
         r = int(color.get("r"))
         g = int(color.get("g"))
         b = int(color.get("b"))
         a = int(color.get("a"))
-        RGBA.MAPPED_COLORS[color.get("index")] = (r, g, b, a)
+        self.colors[color.get("index")] = struct.unpack("<I", struct.pack("<4B", r, g, b, a))[0]
 
-    @staticmethod
-    def from_index(idx):
-        return struct.unpack("<I", struct.pack("<4B", *(RGBA.MAPPED_COLORS[idx])))[0]
+    def color(self, idx):
+        return self.colors[idx]
 
 class Vec2:
     def __init__(self, node, conv=False):
@@ -241,9 +243,9 @@ class Material:
     def __init__(self, bclyt, node):
         assert(node.tag == "Material")
         self.name = node.get("name")
-        self.tev_color = node.get("tev_color")
+        self.tev_color = bclyt.color_from_index(node.get("tev_color"))
         assert(node[0].tag == "TevConstantColors")
-        self.tev_constant_colors = [child.text for child in node[0]]
+        self.tev_constant_colors = [bclyt.color_from_index(child.text) for child in node[0]]
         remaining = node[1:]
         self.font_shadow_param = None
         self.indirect_param = None
@@ -279,7 +281,7 @@ class Material:
                 self.proj_tex_gen_params.append(ProjTexGenParam(bclyt, child))
 
     def write_to_file(self, out):
-        out.write("<20s7I", self.name.encode("utf-8"), RGBA.from_index(self.tev_color), *map(RGBA.from_index, self.tev_constant_colors))
+        out.write("<20s7I", self.name.encode("utf-8"), self.tev_color, *self.tev_constant_colors)
         flags = 0
         flags |= int(self.font_shadow_param is not None) & 1
         flags <<= 2
@@ -397,9 +399,8 @@ class PanelData:
         material_index: int
         another_origin: Vec2
         line_alignment: usefulenums.LineAlignment
-        # color indexes
-        top_color: str
-        bottom_color: str
+        top_color: int
+        bottom_color: int
         text_size: Vec2
         character_size: float
         line_size: float
@@ -422,7 +423,7 @@ class PanelData:
             out.write("<2B2x", origin, self.line_alignment.value)
             text_offset = 0x74  # never observed another value so /shrug
             out.write("<I", text_offset)
-            out.write("<2I", RGBA.from_index(self.top_color), RGBA.from_index(self.bottom_color))
+            out.write("<2I", self.top_color, self.bottom_color)
             self.text_size.write_to_file(out)
             out.write("<2f", self.character_size, self.line_size)
             out.raw(encoded_text)
@@ -442,18 +443,17 @@ class PanelData:
 
     @dataclass
     class PicData(Internal):
-        # color indexes
-        tl_color: str
-        tr_color: str
-        bl_color: str
-        br_color: str
+        tl_color: int
+        tr_color: int
+        bl_color: int
+        br_color: int
         material_index: int
         # texture_coords: List[TexCoord]
         texture_coords: List[Any]
 
         def write_to_file(self, out):
             PanelData.Internal.write_to_file(self, out)
-            out.write("<4I", RGBA.from_index(self.tl_color), RGBA.from_index(self.tr_color), RGBA.from_index(self.bl_color), RGBA.from_index(self.br_color))
+            out.write("<4I", self.tl_color, self.tr_color, self.bl_color, self.br_color)
             out.write("<2H", self.material_index, len(self.texture_coords))
             for coord in self.texture_coords:
                 coord.write_to_file(out)
@@ -496,11 +496,10 @@ class PanelData:
         content_overflow_t: float
         content_overflow_b: float
         flag: int
-        # color indexes
-        tl_color: str
-        tr_color: str
-        bl_color: str
-        br_color: str
+        tl_color: int
+        tr_color: int
+        bl_color: int
+        br_color: int
         material_index: int
         # uvsets: List[UVCoordSet]
         # frames: List[WndFrame]
@@ -512,7 +511,7 @@ class PanelData:
             out.write("<4f", self.content_overflow_l, self.content_overflow_r, self.content_overflow_t, self.content_overflow_b)
             out.write("<2B2x", len(self.frames), self.flag)
             out.write("<2I", 0x68, 0x7c)
-            out.write("<4I", RGBA.from_index(self.tl_color), RGBA.from_index(self.tr_color), RGBA.from_index(self.bl_color), RGBA.from_index(self.br_color))
+            out.write("<4I", self.tl_color, self.tr_color, self.bl_color, self.br_color)
             out.write("<2H", self.material_index, len(self.uvsets))
             for uvset in self.uvsets:
                 uvset.write_to_file(out)
@@ -557,8 +556,8 @@ class PanelData:
             "font_index": bclyt.font_index_from_name,
             "material_index": bclyt.material_index_from_name,
             "line_alignment": lambda f: usefulenums.LineAlignment[f],
-            "top_color": str,
-            "bottom_color": str,
+            "top_color": bclyt.color_from_index,
+            "bottom_color": bclyt.color_from_index,
             "character_size": float,
             "line_size": float,
             "text": str,
@@ -589,10 +588,10 @@ class PanelData:
             "alpha": int,
             "magnification_flags": lambda f: usefulenums.PanelMagnificationFlags[f],
             "name": str,
-            "tl_color": str,
-            "tr_color": str,
-            "bl_color": str,
-            "br_color": str,
+            "tl_color": bclyt.color_from_index,
+            "tr_color": bclyt.color_from_index,
+            "bl_color": bclyt.color_from_index,
+            "br_color": bclyt.color_from_index,
             "material_index": bclyt.material_index_from_name
         }
         out = {}
@@ -629,10 +628,10 @@ class PanelData:
             "content_overflow_t": float,
             "content_overflow_b": float,
             "flag": int,
-            "tl_color": str,
-            "tr_color": str,
-            "bl_color": str,
-            "br_color": str,
+            "tl_color": bclyt.color_from_index,
+            "tr_color": bclyt.color_from_index,
+            "bl_color": bclyt.color_from_index,
+            "br_color": bclyt.color_from_index,
             "material_index": bclyt.material_index_from_name
         }
         out = {}
@@ -701,13 +700,13 @@ class UserData:
             assert(n.tag == "Data")
             namoff = 0
             nam = n.get("name")
-            if USD_TYPE_OVERRIDE == -1:
+            if bclyt.context.usd_type == -1:
                 if nam == "IsAreaRect" or nam == "LayoutIndex":
                     internal_type = 2
                 else:
                     internal_type = 1
             else:
-                internal_type = USD_TYPE_OVERRIDE
+                internal_type = bclyt.context.usd_type
             curtyp = usefulenums.UsdEntryDataType[n.get("type")]
             if curtyp == usefulenums.UsdEntryDataType.String:
                 assert(n[0].tag == "String")
@@ -811,10 +810,8 @@ class BCLYT:
         self.sections.append(Lyt1(self, node))
 
     def add_colors(self, node):
-        self.colors_dict = {}
-        RGBA.MAPPED_COLORS = self.colors_dict
         for color in node:
-            RGBA.add_from_color(color)
+            self.context.add_color(color)
 
     def add_fonts(self, node):
         if len(node) == 0:
@@ -841,8 +838,9 @@ class BCLYT:
         grp  = Group(self, node)
         self.sections += grp.parts
 
-    def __init__(self, root):
+    def __init__(self, root, context=None):
         assert(root.tag == "BCLYT")
+        self.context = BuildContext() if context is None else context
         self.sections = []
         section_type_map = {
             "Layout": self.add_layout,
@@ -865,9 +863,10 @@ class BCLYT:
         return self.fonts[font_name]
     def material_index_from_name(self, material_name):
         return self.materials[material_name]
+    def color_from_index(self, color_index):
+        return self.context.color(color_index)
 
     def write_to_file(self, out):
-        RGBA.MAPPED_COLORS = self.colors_dict
         output = Writable(out)
         sections_data = Writable()
         for s in self.sections:
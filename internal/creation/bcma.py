@@ -1,139 +1,267 @@
+import os
 from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from lxml import etree
 from nlzss3 import compress
 
-from internal import usefulenums, my_rle
-from .darc import DARC
+from internal import usefulenums, image_storage
+from .darc import DARC, DARCWriter
 from . import bclyt
 
+class Cancelled(Exception):
+    pass
+
+def check_cancelled(cancelled):
+    if cancelled is not None and cancelled():
+        raise Cancelled()
+
 class BCMA:
-    def __init__(self, file_obj):
+    """progress, when set, is called with (done, total, message) as the work goes, done and total in bytes of the XML
+    when parsing and in arcs when writing. cancelled, when set, is called between steps, Cancelled is raised once it returns True."""
+    def __init__(self, file_obj, folder="", progress=None, cancelled=None):
         self.common_images = {}
         self.specific_images = {}
         self.indexes = {}
         self.small_pages = {}
         self.large_pages = {}
         self.languages = []
-        tree = etree.parse(file_obj)
-        root = tree.getroot()
-        assert(root.tag == "Manual")
-        for child in root:
-            if child.tag == "ImageArcs":
-                for imagearc in child:
-                    arcname = imagearc.get("name")
+        start = file_obj.tell()
+        size = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(start)
+        # the tree is never built whole: each image, index and subpage is handled as soon as it closes, then dropped
+        path = []
+        for event, node in etree.iterparse(file_obj, events=("start", "end")):
+            if event == "start":
+                parent = path[-1] if len(path) else None
+                path.append(node.tag)
+                if parent is None:
+                    assert(node.tag == "Manual")
+                elif parent == "Manual":
+                    if node.tag not in ("ImageArcs", "BcmaInfo", "Region"):
+                        raise ValueError(f"Unknown tag at Manual level: {node.tag}")
+                    if node.tag == "Region":
+                        region = node.get("region")
+                elif parent == "ImageArcs":
+                    arcname = node.get("name")
                     if arcname == "Common_texture":
                         images_go_here = self.common_images
                     else:
                         images_go_here = self.specific_images[arcname] = {}
-                    for image in imagearc:
-                        imgname = image.get("name")
-                        # print("Found", imgname, "of", arcname)
-                        images_go_here[imgname] = bytes.fromhex(my_rle.do_decompression(image.text))
-            elif child.tag == "BcmaInfo":
-                self.bcma_info = bclyt.BCLYT(child[0])
-            elif child.tag == "Region":
-                region = child.get("region")
-                for language in child:
-                    assert(language.tag == "Pages")
-                    lang = language.get("lang")
+                elif parent == "Region":
+                    assert(node.tag == "Pages")
+                    lang = node.get("lang")
                     full_lang = f"{region}_{lang}"
-                    for page in language:
-                        if page.tag == "Index":
-                            # print("Found index of", full_lang)
-                            bclyt.USD_TYPE_OVERRIDE = 2
-                            self.indexes[full_lang] = bclyt.BCLYT(page[0])
-                            bclyt.USD_TYPE_OVERRIDE = 1
-                        elif page.tag == "Page":
-                            for subpage in page:
-                                assert(subpage.tag == "SubPage")
-                                pnum = page.get('page')
-                                psize = subpage.get('pagesize')
-                                subpnum = subpage.get('subpage')
-                                if subpnum == "info":
-                                    bclyt.USD_TYPE_OVERRIDE = -1
-                                full_page = f"Page_{pnum}_{psize}_{subpnum}"
-                                # print("Found", full_page, "of", full_lang)
-                                if psize == "small":
-                                    arr = self.small_pages.get(full_lang, [])
-                                    # set the pages to point to the newly created list
-                                    if len(arr) == 0:
-                                        self.small_pages[full_lang] = arr
-                                elif psize == "large":
-                                    arr = self.large_pages.get(full_lang, [])
-                                    # set the pages to point to the newly created list
-                                    if len(arr) == 0:
-                                        self.large_pages[full_lang] = arr
-                                else:
-                                    raise ValueError(f"Unknown pagesize at SubPage level: {psize}")
-                                arr.append((full_page, bclyt.BCLYT(subpage[0])))
-                                bclyt.USD_TYPE_OVERRIDE = 1
-                        else:
-                            raise ValueError(f"Unknown tag at Pages level: {page.tag}")
-                    self.languages.append(full_lang)
-            else:
-                raise ValueError(f"Unknown tag at Manual level: {child.tag}")
-
-    def write_to_file(self, out):
-        self.internal_darcs = []
+                elif parent == "Pages":
+                    if node.tag not in ("Index", "Page"):
+                        raise ValueError(f"Unknown tag at Pages level: {node.tag}")
+                    pnum = node.get('page')
+                elif parent == "Page":
+                    assert(node.tag == "SubPage")
+                continue
+
+            path.pop()
+            parent = path[-1] if len(path) else None
+            if parent == "ImageArc":
+                imgname = node.get("name")
+                # print("Found", imgname, "of", arcname)
+                images_go_here[imgname] = image_storage.load_image(node, folder)
+            elif parent == "Manual" and node.tag == "BcmaInfo":
+                self.bcma_info = bclyt.BCLYT(node[0])
+            elif parent == "Pages" and node.tag == "Index":
+                # print("Found index of", full_lang)
+                self.indexes[full_lang] = bclyt.BCLYT(node[0], bclyt.BuildContext(usd_type=2))
+            elif parent == "Page":
+                psize = node.get('pagesize')
+                subpnum = node.get('subpage')
+                context = bclyt.BuildContext(usd_type=-1 if subpnum == "info" else 1)
+                full_page = f"Page_{pnum}_{psize}_{subpnum}"
+                # print("Found", full_page, "of", full_lang)
+                if psize == "small":
+                    arr = self.small_pages.get(full_lang, [])
+                    # set the pages to point to the newly created list
+                    if len(arr) == 0:
+                        self.small_pages[full_lang] = arr
+                elif psize == "large":
+                    arr = self.large_pages.get(full_lang, [])
+                    # set the pages to point to the newly created list
+                    if len(arr) == 0:
+                        self.large_pages[full_lang] = arr
+                else:
+                    raise ValueError(f"Unknown pagesize at SubPage level: {psize}")
+                arr.append((full_page, bclyt.BCLYT(node[0], context)))
+            elif parent == "Region":
+                self.languages.append(full_lang)
+                if progress is not None:
+                    progress(file_obj.tell(), size, f"Read {full_lang}")
+                check_cancelled(cancelled)
+            elif parent == "ImageArcs":
+                if progress is not None:
+                    progress(file_obj.tell(), size, f"Read {arcname}")
+                check_cancelled(cancelled)
+            elif parent not in ("Manual", "Pages"):
+                # inside a layout, bclyt.BCLYT reads those whole once their SubPage/Index closes
+                continue
+            node.clear()
+            while node.getprevious() is not None:
+                del node.getparent()[0]
 
+    def build_base_darcs(self, report=None):
         bclytbytes = BytesIO()
         self.bcma_info.write_to_file(bclytbytes)
         tree_structure = {
             "BcmaInfo.bclyt": bclytbytes.getbuffer()
         }
-        self.internal_darcs.append(("BcmaInfo", DARC({"blyt": tree_structure})))
+        yield ("BcmaInfo", DARC({"blyt": tree_structure}))
 
-        print("Built BcmaInfo DARC")
+        if report is not None:
+            report("Built BcmaInfo DARC")
 
         tree_structure = {}
         for image_name, image_data in self.common_images.items():
             tree_structure[f"{image_name}.bclim"] = image_data
-        self.internal_darcs.append(("Common_texture", DARC({"timg": tree_structure}, 0x100, 0x80)))
+        yield ("Common_texture", DARC({"timg": tree_structure}, 0x100, 0x80))
 
-        print("Built Common_texture DARC")
+        if report is not None:
+            report("Built Common_texture DARC")
 
         for imagarc, arcdata in self.specific_images.items():
             tree_structure = {}
             for image_name, image_data in arcdata.items():
                 tree_structure[f"{image_name}.bclim"] = image_data
-            self.internal_darcs.append((imagarc, DARC({"timg": tree_structure}, 0x100, 0x80)))
+            yield (imagarc, DARC({"timg": tree_structure}, 0x100, 0x80))
+
+        if report is not None:
+            report("Built remaining texture DARCs")
+
+    def build_all_darcs(self, report=None):
+        yield from self.build_base_darcs(report)
+        for reglang in self.languages:
+            yield from build_language_darcs(reglang, self.indexes[reglang], self.large_pages[reglang], self.small_pages[reglang])
 
-        print("Built remaining texture DARCs")
+        if report is not None:
+            report("Built DARCs")
 
+    def write_to_file(self, out, jobs=None, cache=None, progress=None, cancelled=None):
+        """Builds the complete BCMA into out, which must be seekable.
+        Each arc is written as soon as it is compressed, so only a few of them are in memory at once.
+        With jobs set, the region/language arcs are built by that many worker processes.
+        With cache (an ArcCache) set, arcs that did not change since a previous build are not recompressed.
+        If cancelled, out is left incomplete."""
         self.languages.sort()
+        arc_names = ["BcmaInfo", "Common_texture", *self.specific_images]
         for reglang in self.languages:
-            bclytbytes = BytesIO()
+            arc_names += [f"{reglang}_index", f"{reglang}_large", f"{reglang}_small"]
+        final_darc = DARCWriter(out, [f"{darc_name}.arc" for darc_name in arc_names], 0x20)
+        written = 0
 
-            self.indexes[reglang].write_to_file(bclytbytes)
-            tree_structure = {
-                "Index.bclyt": bclytbytes.getbuffer()
-            }
-            self.internal_darcs.append((f"{reglang}_index", DARC({"blyt": tree_structure})))
+        def report(message):
+            if progress is not None:
+                progress(written, len(arc_names), message)
 
-            tree_structure = {}
-            for name, large_page in self.large_pages[reglang]:
-                bclytbytes = BytesIO()
-                large_page.write_to_file(bclytbytes)
-                n = f"{name}.bclyt"
-                tree_structure[n] = bclytbytes.getvalue()
-            self.internal_darcs.append((f"{reglang}_large", DARC({"blyt": tree_structure}, file_padding_part=0x4)))
+        def add(data):
+            nonlocal written
+            check_cancelled(cancelled)
+            final_darc.add(data)
+            written += 1
 
-            tree_structure = {}
-            for name, small_page in self.small_pages[reglang]:
-                bclytbytes = BytesIO()
-                small_page.write_to_file(bclytbytes)
-                n = f"{name}.bclyt"
-                tree_structure[n] = bclytbytes.getvalue()
-            self.internal_darcs.append((f"{reglang}_small", DARC({"blyt": tree_structure}, file_padding_part=0x4)))
+        if jobs is None:
+            for darc_name, data in compress_darcs(self.build_all_darcs(report), report, cache):
+                add(data)
+        else:
+            # every region/language is serialized and compressed in its own worker,
+            # while this process compresses the BcmaInfo and texture arcs.
+            # at most jobs languages are in flight, the results are written in order
+            languages = deque(self.languages)
+            futures = deque()
+            with ProcessPoolExecutor(jobs) as pool:
+                def submit_language():
+                    reglang = languages.popleft()
+                    futures.append((reglang, pool.submit(build_language_arcs, reglang, self.indexes[reglang], self.large_pages[reglang], self.small_pages[reglang], cache)))
 
-        print("Built DARCs")
+                while languages and len(futures) < jobs:
+                    submit_language()
+                try:
+                    for darc_name, data in compress_darcs(self.build_base_darcs(report), report, cache):
+                        add(data)
+                    while futures:
+                        reglang, future = futures.popleft()
+                        if languages:
+                            submit_language()
+                        for darc_name, data in future.result():
+                            add(data)
+                        report(f"Built and compressed {reglang}")
+                except Cancelled:
+                    # don't start the languages still waiting, only the ones already running are waited for
+                    pool.shutdown(cancel_futures=True)
+                    raise
 
-        tree_structure = {}
-        for darc_name, darc in self.internal_darcs:
+        if cache is not None:
+            cache.evict()
+
+        final_darc.close()
+
+def build_language_darcs(reglang, index, large_pages, small_pages):
+    darcs = []
+    bclytbytes = BytesIO()
+
+    index.write_to_file(bclytbytes)
+    tree_structure = {
+        "Index.bclyt": bclytbytes.getbuffer()
+    }
+    darcs.append((f"{reglang}_index", DARC({"blyt": tree_structure})))
+
+    tree_structure = {}
+    for name, large_page in large_pages:
+        bclytbytes = BytesIO()
+        large_page.write_to_file(bclytbytes)
+        n = f"{name}.bclyt"
+        tree_structure[n] = bclytbytes.getbuffer()
+    darcs.append((f"{reglang}_large", DARC({"blyt": tree_structure}, file_padding_part=0x4)))
+
+    tree_structure = {}
+    for name, small_page in small_pages:
+        bclytbytes = BytesIO()
+        small_page.write_to_file(bclytbytes)
+        n = f"{name}.bclyt"
+        tree_structure[n] = bclytbytes.getbuffer()
+    darcs.append((f"{reglang}_small", DARC({"blyt": tree_structure}, file_padding_part=0x4)))
+    return darcs
+
+def compress_darcs(darcs, report=None, cache=None):
+    """Yields (name, compressed data) for each (name, DARC) of darcs, in the same order, telling report about each.
+    compress releases the GIL, so a few arcs are compressed at once on threads,
+    but no more are taken from darcs than the threads can work on."""
+    workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for darc_name, darc in darcs:
             darc_bytes = BytesIO()
             darc.write_to_file(darc_bytes)
-            print("Compressing", darc_name)
-            tree_structure[f"{darc_name}.arc"] = compress(darc_bytes.getvalue())
-        final_darc = DARC(tree_structure, 0x20)
-        final_darc.write_to_file(out)
+            data = darc_bytes.getbuffer()
+            result = None
+            if cache is not None:
+                key = cache.key(data)
+                result = cache.get(key)
+                if result is not None and report is not None:
+                    report(f"Reusing cached {darc_name}")
+            if result is None:
+                if report is not None:
+                    report(f"Compressing {darc_name}")
+                if cache is None:
+                    result = pool.submit(compress, data)
+                else:
+                    result = pool.submit(cache.compress_missing, data, key)
+            pending.append((darc_name, result))
+            while len(pending) > workers:
+                yield finish_compression(*pending.popleft())
+        while pending:
+            yield finish_compression(*pending.popleft())
+
+def finish_compression(darc_name, result):
+    return darc_name, result if type(result) is bytes else result.result()
+
+def build_language_arcs(reglang, index, large_pages, small_pages, cache=None):
+    # runs in a worker process for BCMA.write_to_file(out, jobs), the parent does the reporting
+    return list(compress_darcs(build_language_darcs(reglang, index, large_pages, small_pages), None, cache))
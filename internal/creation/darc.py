@@ -24,61 +24,107 @@ class TableEntry:
         self.data_off = data_offset_from_end
         self.size = size
 
-class DARC:
-    def __init__(self, file_tree, names_padding_part=0x4, file_padding_part=0x10):
-        folders, files = explore_tree(file_tree)
-        assert(len(folders) <= 1) # only supports trees with 1 folder or none at all
-        header_size = 0x1c
-        header_bom = 0xfeff
-        header_version = 0x01000000
-        self.header = struct.pack("<4s2HI", b"darc", header_bom, header_size, header_version)
-        table_start = header_size
-        table_entries_count = len(folders) + len(files) + 2
+class DARCLayout:
+    # header, table and names of a DARC, everything that comes before the file data
+    header_size = 0x1c
+
+    def __init__(self, folders, filenames, names_padding_part):
+        table_start = self.header_size
+        table_entries_count = len(folders) + len(filenames) + 2
         table_entries_size = table_entries_count * 0xC
         self.names = bytearray.fromhex("00002e000000")
-        entries = []
-        entries.append(TableEntry(True, 0, 0, table_entries_count))
-        entries.append(TableEntry(True, 2, 0, table_entries_count))
+        self.entries = []
+        self.entries.append(TableEntry(True, 0, 0, table_entries_count))
+        self.entries.append(TableEntry(True, 2, 0, table_entries_count))
         name_index = len(self.names)
         for foldername in folders:
             encoded = foldername.encode("utf-16le") + (b"\x00" * 2)
             self.names.extend(encoded)
-            entries.append(TableEntry(True, name_index, 1, table_entries_count))  # dunno why, but observed 1
+            self.entries.append(TableEntry(True, name_index, 1, table_entries_count))  # dunno why, but observed 1
             name_index += len(encoded)
-        table_files_start_index = len(entries)
-        for filename, data in files.items():
+        self.table_files_start_index = len(self.entries)
+        for filename in filenames:
             encoded = os.path.basename(filename).encode("utf-16le") + (b"\x00" * 2)
             self.names.extend(encoded)
-            entries.append(TableEntry(False, name_index, 0, len(data)))
-            entries[-1].data = data
+            self.entries.append(TableEntry(False, name_index, 0, 0))
             name_index += len(encoded)
 
         # pad to 4 byte boundary
         names_len = table_start + table_entries_size + len(self.names)
-        names_padding_size_d = names_len & (names_padding_part-1)
-        names_padding_size_other = names_len & 3
-        if names_padding_size_d != 0:
-            names_padding_size_d = (names_padding_part - names_padding_size_d)
-            self.names += b"\x00" * names_padding_size_d
-        data_start = table_start + table_entries_size + len(self.names)
+        self.names_padding_size_d = names_len & (names_padding_part-1)
+        self.names_padding_size_other = names_len & 3
+        if self.names_padding_size_d != 0:
+            self.names_padding_size_d = (names_padding_part - self.names_padding_size_d)
+            self.names += b"\x00" * self.names_padding_size_d
+        self.data_start = table_start + table_entries_size + len(self.names)
 
-        self.filedata = bytearray()
-        for i in range(table_files_start_index, len(entries)):
-            new_off = len(self.filedata) + data_start
-            entries[i].data_off = new_off
-            self.filedata += entries[i].data
-            diff = len(self.filedata) & (file_padding_part-1)
-            if diff != 0 and not len(entries) == (i+1):
-                self.filedata += b"\x00" * (file_padding_part - diff)
+    def set_file(self, i, data_off, size):
+        entry = self.entries[self.table_files_start_index + i]
+        entry.data_off = data_off
+        entry.size = size
 
-        self.entries_data = bytearray()
-        for e in entries:
-            self.entries_data += struct.pack("<3I", e.name_off, e.data_off, e.size)
-        filelen = header_size + len(self.entries_data) + len(self.names) + len(self.filedata)
-        self.header += struct.pack("<4I", filelen, table_start, len(self.entries_data) + len(self.names) - names_padding_size_d , data_start - names_padding_size_d + names_padding_size_other)
+    def write_layout(self, out, filedata_len):
+        entries_data = bytearray()
+        for e in self.entries:
+            entries_data += struct.pack("<3I", e.name_off, e.data_off, e.size)
+        filelen = self.data_start + filedata_len
+        out.write(struct.pack("<4s2HI", b"darc", 0xfeff, self.header_size, 0x01000000))
+        out.write(struct.pack("<4I", filelen, self.header_size, len(entries_data) + len(self.names) - self.names_padding_size_d, self.data_start - self.names_padding_size_d + self.names_padding_size_other))
+        out.write(entries_data)
+        out.write(self.names)
+
+class DARC(DARCLayout):
+    def __init__(self, file_tree, names_padding_part=0x4, file_padding_part=0x10):
+        folders, files = explore_tree(file_tree)
+        assert(len(folders) <= 1) # only supports trees with 1 folder or none at all
+        DARCLayout.__init__(self, folders, files.keys(), names_padding_part)
+
+        # keep references to the files rather than concatenating them, write_to_file outputs them one by one
+        self.filedata = []
+        self.filedata_len = 0
+        for i, data in enumerate(files.values()):
+            self.set_file(i, self.filedata_len + self.data_start, len(data))
+            self.filedata.append(data)
+            self.filedata_len += len(data)
+            diff = self.filedata_len & (file_padding_part-1)
+            if diff != 0 and not len(files) == (i+1):
+                self.filedata.append(b"\x00" * (file_padding_part - diff))
+                self.filedata_len += file_padding_part - diff
 
     def write_to_file(self, out):
-        out.write(self.header)
-        out.write(self.entries_data)
-        out.write(self.names)
-        out.write(self.filedata)
\ No newline at end of file
+        self.write_layout(out, self.filedata_len)
+        for data in self.filedata:
+            out.write(data)
+
+class DARCWriter(DARCLayout):
+    """Streams a DARC without folders to a seekable file.
+    The names of the files must be known up front, their data is written as soon as it is added,
+    and close() goes back to fill in the header and table."""
+
+    def __init__(self, out, filenames, names_padding_part=0x4, file_padding_part=0x10):
+        DARCLayout.__init__(self, (), filenames, names_padding_part)
+        self.out = out
+        self.base = out.tell()
+        self.file_padding_part = file_padding_part
+        self.files_count = len(filenames)
+        self.files_added = 0
+        self.filedata_len = 0
+        out.seek(self.base + self.data_start)
+
+    def add(self, data):
+        assert(self.files_added < self.files_count)
+        self.set_file(self.files_added, self.filedata_len + self.data_start, len(data))
+        self.out.write(data)
+        self.filedata_len += len(data)
+        self.files_added += 1
+        diff = self.filedata_len & (self.file_padding_part-1)
+        if diff != 0 and self.files_added != self.files_count:
+            self.out.write(b"\x00" * (self.file_padding_part - diff))
+            self.filedata_len += self.file_padding_part - diff
+
+    def close(self):
+        assert(self.files_added == self.files_count)
+        end = self.out.tell()
+        self.out.seek(self.base)
+        self.write_layout(self.out, self.filedata_len)
+        self.out.seek(end)
@@ -0,0 +1,8 @@
+from .texturecache import TextureCache
+from .manualindex import ManualIndex
+from .pagemodel import PageTreeModel
+from .layoutrenderer import LayoutRenderer
+from .project import Man3Project
+from .workers import Worker
+
+__all__ = ("TextureCache", "ManualIndex", "PageTreeModel", "LayoutRenderer", "Man3Project", "Worker")
@@ -0,0 +1,197 @@
+from PySide2.QtCore import QObject
+from PySide2.QtCore import QPointF
+from PySide2.QtCore import QRectF
+from PySide2.QtCore import Slot
+from PySide2.QtCore import Qt
+from PySide2.QtGui import QBrush
+from PySide2.QtGui import QColor
+from PySide2.QtGui import QFont
+from PySide2.QtGui import QLinearGradient
+from PySide2.QtGui import QPen
+from PySide2.QtGui import QStaticText
+from PySide2.QtGui import QTransform
+from PySide2.QtWidgets import QGraphicsItem
+
+from internal.extraction.bclyt import Pic1, Txt1, Wnd1, split_color
+
+# where along the width/height of a panel each origin is, from its top left
+H_ANCHOR = {"Left": 0.0, "Center": 0.5, "Right": 1.0}
+V_ANCHOR = {"Top": 0.0, "Middle": 0.5, "Bottom": 1.0}
+
+def to_qcolor(rgba):
+    c = split_color(rgba.number)
+    return QColor(c.r, c.g, c.b, c.a)
+
+class PanelItem(QGraphicsItem):
+    """One panel of a layout. Its children are child items, so moving it moves them without them being touched."""
+    def __init__(self, renderer, wrapper, parent=None):
+        super(PanelItem, self).__init__(parent)
+        self.renderer = renderer
+        self.wrapper = wrapper
+        self.rect = QRectF()
+        self.static_text = None
+        self.sync()
+
+    def sync(self):
+        # re-reads the panel after an edit, only this item (and the position of its children if its size moved) is redone
+        d = self.wrapper.pan.data
+        w, h = d.size.x, d.size.y
+        rect = QRectF(-H_ANCHOR[d.origin.x] * w, -V_ANCHOR[d.origin.y] * h, w, h)
+        if rect != self.rect:
+            self.prepareGeometryChange()
+            self.rect = rect
+            for child in self.childItems():
+                child.place()
+        self.place()
+        if type(self.wrapper.pan) is Txt1:
+            # the bounding rect follows the size of the text, which may have changed
+            self.prepareGeometryChange()
+            self.prepare_text()
+        self.update()
+
+    def place(self):
+        d = self.wrapper.pan.data
+        anchor = QPointF()
+        parent = self.parentItem()
+        if parent is not None:
+            r = parent.rect
+            anchor = QPointF(r.left() + H_ANCHOR[d.parent_origin.x] * r.width(), r.top() + V_ANCHOR[d.parent_origin.y] * r.height())
+        # layouts have y going up, the scene has it going down
+        self.setPos(anchor + QPointF(d.translation.x, -d.translation.y))
+        transform = QTransform()
+        transform.rotate(-d.rotation.z)
+        transform.scale(d.scale.x, d.scale.y)
+        self.setTransform(transform)
+        self.setOpacity(d.alpha / 255)
+
+    def prepare_text(self):
+        d = self.wrapper.pan.data
+        self.font = QFont()
+        self.font.setPixelSize(max(1, int(d.text_size.y)))
+        self.static_text = QStaticText(d.text)
+        self.static_text.setTextWidth(self.rect.width())
+        self.static_text.prepare(QTransform(), self.font)
+
+    def boundingRect(self):
+        if self.static_text is not None:
+            return self.rect.united(QRectF(self.rect.topLeft(), self.static_text.size()))
+        return self.rect
+
+    def paint(self, painter, option, widget=None):
+        pan = self.wrapper.pan
+        d = pan.data
+        if type(pan) is Pic1:
+            pixmap = self.renderer.pixmap(self, d.material_name)
+            if pixmap is not None:
+                source = QRectF(0, 0, pixmap.width(), pixmap.height())
+                if len(d.texture_coords):
+                    # texture coordinates have v going up, from the bottom of the texture
+                    tl, br = d.texture_coords[0].TopLeft, d.texture_coords[0].BottomRight
+                    source = QRectF(QPointF(tl.x * pixmap.width(), (1 - tl.y) * pixmap.height()), QPointF(br.x * pixmap.width(), (1 - br.y) * pixmap.height()))
+                painter.drawPixmap(self.rect, pixmap, source.normalized())
+            else:
+                self.paint_vertex_colors(painter, d)
+        elif type(pan) is Wnd1:
+            self.paint_vertex_colors(painter, d)
+            pixmap = self.renderer.pixmap(self, d.material_name)
+            if pixmap is not None:
+                painter.drawPixmap(self.rect, pixmap, QRectF(pixmap.rect()))
+        elif type(pan) is Txt1:
+            painter.setFont(self.font)
+            painter.setPen(to_qcolor(d.top_color))
+            offset = {"Center": 0.5, "Right": 1.0}.get(d.line_alignment, 0.0) * (self.rect.width() - self.static_text.size().width())
+            painter.drawStaticText(self.rect.topLeft() + QPointF(max(0, offset), 0), self.static_text)
+        if self.isSelected():
+            painter.setPen(QPen(Qt.red, 0, Qt.DashLine))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect(self.rect)
+
+    def paint_vertex_colors(self, painter, d):
+        # only the top left and bottom left colors, as a vertical gradient
+        gradient = QLinearGradient(self.rect.topLeft(), self.rect.bottomLeft())
+        gradient.setColorAt(0, to_qcolor(d.tl_color))
+        gradient.setColorAt(1, to_qcolor(d.bl_color))
+        painter.fillRect(self.rect, QBrush(gradient))
+
+class LayoutRenderer(QObject):
+    """Draws a BCLYT in a QGraphicsScene. show() builds the items of a page once,
+    after that edits to a panel only update its own item through panel_changed() or set_text().
+    textures is a TextureCache and texture_data(name, region, lang) gives the .bclim of a texture for the layouts of a language (or None),
+    without them pictures only show their vertex colors."""
+    def __init__(self, scene, textures=None, texture_data=None, parent=None):
+        super(LayoutRenderer, self).__init__(parent)
+        self.scene = scene
+        self.textures = textures
+        self.texture_data = texture_data
+        self.layout = None
+        self.region = None
+        self.lang = None
+        self.items = {}
+        self.materials = {}
+        self.texture_keys = {}
+        self.waiting = {}
+        if textures is not None:
+            textures.textureReady.connect(self.texture_ready)
+
+    def reset(self):
+        # for a new manual, or when its images changed: texture names are looked up again
+        self.texture_keys.clear()
+        self.waiting.clear()
+
+    def show(self, layout, region=None, lang=None):
+        # region and lang are where the layout is from, for its textures
+        self.scene.clear()
+        self.items.clear()
+        self.waiting.clear()
+        self.layout = layout
+        self.region = region
+        self.lang = lang
+        self.materials = {m.data.name: m for m in layout.materials}
+        size = layout.layout.data.size
+        self.scene.setSceneRect(-size.x / 2, -size.y / 2, size.x, size.y)
+        if layout.root_panel is not None:
+            self.add(layout.root_panel, None)
+
+    def add(self, wrapper, parent_item):
+        item = PanelItem(self, wrapper, parent_item)
+        item.setFlag(QGraphicsItem.ItemIsSelectable)
+        if parent_item is None:
+            self.scene.addItem(item)
+        self.items[wrapper.pan.data.name] = item
+        for child in wrapper.children:
+            self.add(child, item)
+
+    def panel_changed(self, name):
+        self.items[name].sync()
+
+    def set_text(self, name, text):
+        item = self.items[name]
+        item.wrapper.pan.data.text = text
+        item.sync()
+
+    def pixmap(self, item, material_name):
+        # the texture of the first texture map of the material, None until the cache has it
+        material = self.materials.get(material_name)
+        if material is None or not len(material.data.tex_maps) or self.textures is None or self.texture_data is None:
+            return None
+        texture_name = material.data.tex_maps[0].data.texture_name
+        lookup = (self.region, self.lang, texture_name)
+        if lookup not in self.texture_keys:
+            data = self.texture_data(texture_name, self.region, self.lang)
+            # missing ones are remembered too, so they aren't looked for again on every repaint
+            self.texture_keys[lookup] = None if data is None else self.textures.request(texture_name, data)[0]
+        key = self.texture_keys[lookup]
+        if key is None or key in self.textures.failed:
+            return None
+        pixmap = self.textures.pixmap(key)
+        if pixmap is None:
+            if key not in self.textures.pending:
+                # dropped from memory since
+                self.textures.request(texture_name, self.texture_data(texture_name, self.region, self.lang))
+            self.waiting.setdefault(key, set()).add(item)
+        return pixmap
+
+    @Slot(str, object)
+    def texture_ready(self, name, key):
+        for item in self.waiting.pop(key, ()):
+            item.update()
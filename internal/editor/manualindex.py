@@ -0,0 +1,129 @@
+import os
+import mmap
+
+from internal import lzss3_dec
+from internal.extraction import LazyDARC
+
+LAYOUT_ARCS = ("index", "large", "small")
+COMMON_TEXTURE_ARC = "Common_texture"
+
+def texture_arcs(region=None, lang=None):
+    # where the textures of a language's layouts are looked for, in order
+    if region is None or lang is None:
+        return [COMMON_TEXTURE_ARC]
+    return [f"{region}_{lang}_image", COMMON_TEXTURE_ARC]
+
+def open_arc(data):
+    try:
+        data = lzss3_dec.decompress_bytes(data)
+    except lzss3_dec.DecompressionError:
+        pass
+    return LazyDARC(data)
+
+class ManualIndex:
+    """Where the layouts of a .bcma are, by region -> language -> page -> subpage.
+    Opening it only reads the table of the main arc, the arcs of a language are decompressed when its pages are asked for."""
+    def __init__(self, data):
+        self.arc = open_arc(data)
+        # region -> language -> arc type -> name in the main arc
+        self.arcs = {}
+        # image arc name -> name in the main arc
+        self.image_arcs = {}
+        for k in self.arc.names():
+            arcname, ext = os.path.splitext(os.path.basename(k))
+            parts = arcname.split("_")
+            if ext != ".arc" or arcname == "BcmaInfo":
+                continue
+            if len(parts) != 3 or parts[2] not in LAYOUT_ARCS:
+                self.image_arcs[arcname] = k
+                continue
+            self.arcs.setdefault(parts[0], {}).setdefault(parts[1], {})[parts[2]] = k
+        # image arc name -> {texture name: .bclim}, filled as the image arcs get decompressed
+        self.textures = {}
+        # the map made by from_file, closed by close()
+        self.mapping = None
+
+    @classmethod
+    def from_file(cls, f):
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index = cls(mapping)
+        index.mapping = mapping
+        return index
+
+    def close(self):
+        # layouts still shown may hold views of the map, it is then unmapped once they are gone
+        self.textures = {}
+        self.arc.close()
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                pass
+            self.mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def regions(self):
+        return list(self.arcs)
+
+    def languages(self, region):
+        return list(self.arcs[region])
+
+    def arc_textures(self, arc_name):
+        # the image arc is decompressed the first time
+        textures = self.textures.get(arc_name)
+        if textures is None:
+            textures = {}
+            arc = open_arc(self.arc.get(self.image_arcs[arc_name]))
+            for filename in arc.names():
+                texture_name, ext = os.path.splitext(os.path.basename(filename))
+                if ext == ".bclim":
+                    textures[texture_name] = arc.get(filename)
+            self.textures[arc_name] = textures
+        return textures
+
+    def image(self, arc_name, name):
+        if arc_name not in self.image_arcs:
+            return None
+        return self.arc_textures(arc_name).get(name)
+
+    def texture(self, name, region=None, lang=None):
+        """The .bclim of a texture by its name in the layouts of a language, or None.
+        It is looked for in the image arc of the language, then in Common_texture."""
+        for arc_name in texture_arcs(region, lang):
+            data = self.image(arc_name, name)
+            if data is not None:
+                return data
+        return None
+
+    def image_arc_names(self):
+        return list(self.image_arcs)
+
+    def image_names(self, arc_name):
+        # decompresses the arc if it wasn't yet
+        return list(self.arc_textures(arc_name))
+
+    def pages(self, region, lang):
+        """The index layout and {page: [(pagesize, subpage, layout)]} of a language, the layouts as unparsed .bclyt data."""
+        arcs = self.arcs[region][lang]
+        index = None
+        pages = {}
+        for typ in LAYOUT_ARCS:
+            if typ not in arcs:
+                continue
+            arc = open_arc(self.arc.get(arcs[typ]))
+            for name in arc.names():
+                filename = os.path.basename(name)
+                if not filename.endswith(".bclyt"):
+                    continue
+                if typ == "index":
+                    index = arc.get(name)
+                else:
+                    page = filename[5:8]
+                    sub_page = filename.split("_")[-1].split(".")[0]
+                    pages.setdefault(page, []).append((typ, sub_page, arc.get(name)))
+        return index, dict(sorted(pages.items()))
@@ -0,0 +1,123 @@
+from PySide2.QtCore import QAbstractItemModel
+from PySide2.QtCore import QModelIndex
+from PySide2.QtCore import Qt
+
+from internal.extraction import BCLYT
+
+class PageNode:
+    def __init__(self, parent, row, label, load_children=None, layout_data=None):
+        self.parent = parent
+        self.row = row
+        self.label = label
+        # None until fetched, leaves have nothing to load
+        self.load_children = load_children
+        self.children = None if load_children is not None else []
+        self.layout_data = layout_data
+        self.layout = None
+
+class PageTreeModel(QAbstractItemModel):
+    """Region -> language -> page -> subpage tree over a ManualIndex.
+    The children of a node are only made when the view fetches them (the node is expanded),
+    and a layout is only parsed when layout() is asked for it (the subpage is selected)."""
+    def __init__(self, manual, region_order=None, parent=None):
+        super(PageTreeModel, self).__init__(parent)
+        self.manual = manual
+        self.region_order = region_order
+        self.root = PageNode(None, 0, "", self.region_nodes)
+
+    # each of those gives the (label, load_children, layout_data) of the children of a node
+    def region_nodes(self):
+        regions = self.manual.regions()
+        if self.region_order is not None:
+            regions.sort(key=lambda r: self.region_order.index(r) if r in self.region_order else len(self.region_order))
+        return [(region, lambda region=region: self.language_nodes(region), None) for region in regions]
+
+    def language_nodes(self, region):
+        return [(lang, lambda lang=lang: self.page_nodes(region, lang), None) for lang in self.manual.languages(region)]
+
+    def page_nodes(self, region, lang):
+        # this is where the arcs of the language get decompressed
+        index, pages = self.manual.pages(region, lang)
+        out = []
+        if index is not None:
+            out.append(("Index", None, index))
+        for page, subpages in pages.items():
+            subpage_nodes = [("{} {}".format(typ, sub_page), None, data) for typ, sub_page, data in subpages]
+            out.append(("Page {}".format(page), lambda subpage_nodes=subpage_nodes: subpage_nodes, None))
+        return out
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.node(parent)
+        if node.children is None or not (0 <= row < len(node.children)) or column != 0:
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        node = self.node(parent)
+        return 0 if node.children is None else len(node.children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        # not fetched yet, the view shows an expander and fetches them when it is used
+        return node.children is None or len(node.children) != 0
+
+    def canFetchMore(self, parent):
+        return self.node(parent).children is None
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        if node.children is not None:
+            return
+        items = node.load_children()
+        if len(items) == 0:
+            node.children = []
+            return
+        self.beginInsertRows(parent, 0, len(items) - 1)
+        node.children = [PageNode(node, row, label, load_children, layout_data) for row, (label, load_children, layout_data) in enumerate(items)]
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role == Qt.DisplayRole:
+            return index.internalPointer().label
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def language(self, index):
+        """(region, language) the node is under, (None, None) above the languages."""
+        labels = []
+        node = self.node(index)
+        while node is not self.root:
+            labels.append(node.label)
+            node = node.parent
+        if len(labels) < 2:
+            return None, None
+        return labels[-1], labels[-2]
+
+    def layout(self, index):
+        """The parsed BCLYT of a subpage or index, None for the other nodes."""
+        node = self.node(index)
+        if node.layout_data is None:
+            return None
+        if node.layout is None:
+            data = node.layout_data
+            # projects only build the .bclyt when it is needed
+            node.layout = BCLYT(data() if callable(data) else data)
+        return node.layout
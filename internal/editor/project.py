@@ -0,0 +1,300 @@
+import os
+import json
+import hashlib
+import zipfile
+import tempfile
+import functools
+from io import BytesIO
+
+from lxml import etree
+
+from internal import image_storage
+from internal.creation import BCMA
+from internal.creation import bclyt as creation_bclyt
+from internal.creation.bcma import check_cancelled
+from .manualindex import texture_arcs
+
+INDEX_FOLDER = "index/"
+BCMAINFO_MEMBER = "BcmaInfo.xml"
+
+def page_member(region, lang, page, pagesize, subpage):
+    return f"pages/{region}_{lang}/Page_{page}_{pagesize}_{subpage}.xml"
+
+def index_member(region, lang):
+    return f"pages/{region}_{lang}/Index.xml"
+
+def image_member(arc, name):
+    return f"images/{arc}/{name}.bclim"
+
+class Man3Project:
+    """A .man3 project: a zip with a member for the BcmaInfo, each index and subpage (as their BCLYT XML) and each image (as .bclim).
+    The latest index member maps each of those names to the zip member holding its current version, with its offset and hash.
+    Opening only reads that index, the rest is read when asked for. Saving appends the changed members and a new index
+    to the zip, the versions they replace stay until compact() rewrites it, which save() does once they are most of the file."""
+    def __init__(self, path):
+        self.path = path
+        self.generation = -1
+        # name -> {"member", "offset", "size", "compressed", "sha1"}
+        self.entries = {}
+        # name -> new data, None for removed ones
+        self.changes = {}
+        self.zip = None
+        if os.path.exists(path):
+            z = self.archive()
+            indexes = [n for n in z.namelist() if n.startswith(INDEX_FOLDER)]
+            if len(indexes):
+                latest = max(indexes, key=lambda n: int(os.path.splitext(n[len(INDEX_FOLDER):])[0]))
+                index = json.loads(z.read(latest))
+                self.generation = index["generation"]
+                self.entries = index["members"]
+
+    def archive(self):
+        if self.zip is None:
+            self.zip = zipfile.ZipFile(self.path)
+        return self.zip
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+            self.zip = None
+
+    def names(self):
+        names = set(self.entries)
+        for name, data in self.changes.items():
+            if data is None:
+                names.discard(name)
+            else:
+                names.add(name)
+        return sorted(names)
+
+    def exists(self, name):
+        if name in self.changes:
+            return self.changes[name] is not None
+        return name in self.entries
+
+    def read(self, name):
+        if name in self.changes:
+            data = self.changes[name]
+            if data is None:
+                raise KeyError(name)
+            return data
+        return self.archive().read(self.entries[name]["member"])
+
+    def write(self, name, data):
+        data = bytes(data)
+        entry = self.entries.get(name)
+        if entry is not None and entry["sha1"] == hashlib.sha1(data).hexdigest():
+            # back to what is saved
+            self.changes.pop(name, None)
+        else:
+            self.changes[name] = data
+
+    def remove(self, name):
+        self.changes[name] = None
+
+    def save(self):
+        if not len(self.changes) and self.generation >= 0:
+            return
+        self.close()
+        generation = self.generation + 1
+        with zipfile.ZipFile(self.path, "a", zipfile.ZIP_DEFLATED) as z:
+            for name, data in self.changes.items():
+                if data is None:
+                    self.entries.pop(name, None)
+                else:
+                    self.entries[name] = self.write_member(z, f"{generation}/{name}", data)
+            self.write_index(z, generation)
+        self.generation = generation
+        self.changes.clear()
+
+        live = sum(entry["compressed"] for entry in self.entries.values())
+        if os.path.getsize(self.path) > 2 * live + 0x100000:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the zip with only the current version of each member."""
+        self.save()
+        generation = self.generation + 1
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".man3")
+        os.close(fd)
+        entries = {}
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+            for name in self.names():
+                entries[name] = self.write_member(z, f"{generation}/{name}", self.read(name))
+            self.entries = entries
+            self.write_index(z, generation)
+        self.close()
+        os.replace(tmp, self.path)
+        self.generation = generation
+
+    def write_member(self, z, member, data):
+        z.writestr(member, data)
+        info = z.getinfo(member)
+        return {"member": member, "offset": info.header_offset, "size": info.file_size, "compressed": info.compress_size, "sha1": hashlib.sha1(data).hexdigest()}
+
+    def write_index(self, z, generation):
+        z.writestr(f"{INDEX_FOLDER}{generation}.json", json.dumps({"generation": generation, "members": self.entries}))
+
+    def import_manual(self, file_obj, folder="", progress=None, cancelled=None):
+        """Splits a Manual XML into the members of the project, folder is where the XML is, for images stored as files.
+        The project ends up with only what is in the XML, members it doesn't have are removed.
+        progress and cancelled are like for BCMA."""
+        start = file_obj.tell()
+        size = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(start)
+        imported = set()
+
+        def add(name, data):
+            imported.add(name)
+            self.write(name, data)
+
+        for event, node in etree.iterparse(file_obj, events=("end",)):
+            parent = node.getparent()
+            if parent is None:
+                continue
+            if node.tag == "Image" and parent.tag == "ImageArc":
+                add(image_member(parent.get("name"), node.get("name")), image_storage.load_image(node, folder))
+            elif node.tag == "BcmaInfo" and parent.tag == "Manual":
+                add(BCMAINFO_MEMBER, etree.tostring(node[0]))
+            elif node.tag == "Index" and parent.tag == "Pages":
+                add(index_member(parent.getparent().get("region"), parent.get("lang")), etree.tostring(node[0]))
+            elif node.tag == "SubPage" and parent.tag == "Page":
+                pages = parent.getparent()
+                add(page_member(pages.getparent().get("region"), pages.get("lang"), parent.get("page"), node.get("pagesize"), node.get("subpage")), etree.tostring(node[0]))
+            elif node.tag == "Pages" and progress is not None:
+                progress(file_obj.tell(), size, f"Imported {parent.get('region')}_{node.get('lang')}")
+            else:
+                continue
+            node.clear()
+            check_cancelled(cancelled)
+
+        for name in self.names():
+            if name not in imported:
+                self.remove(name)
+
+    def export_manual(self, savepos, progress=None, cancelled=None):
+        """Writes the Manual XML of the project, for creator.py. The images are stored as base64 of zlib data.
+        progress and cancelled are like for BCMA, done and total count the members."""
+        images = {}
+        layouts = {}
+        for name in self.names():
+            parts = name.split("/")
+            if parts[0] == "images":
+                images.setdefault(parts[1], []).append((os.path.splitext(parts[2])[0], name))
+            elif parts[0] == "pages":
+                region, lang = parts[1].split("_")
+                layouts.setdefault(region, {}).setdefault(lang, []).append(name)
+        for region, langs in layouts.items():
+            for lang in langs:
+                # creator.py needs one for every language
+                if index_member(region, lang) not in langs[lang]:
+                    raise ValueError(f"{region}_{lang} has pages but no Index")
+        total = len(self.names())
+        done = 0
+
+        def step(message):
+            nonlocal done
+            check_cancelled(cancelled)
+            done += 1
+            if progress is not None:
+                progress(done, total, message)
+
+        with etree.xmlfile(savepos, encoding="utf-8") as xf:
+            xf.write_declaration()
+            with xf.element("Manual"):
+                with xf.element("ImageArcs"):
+                    for arc, arc_images in images.items():
+                        with xf.element("ImageArc", name=arc):
+                            for imgname, name in arc_images:
+                                with xf.element("Image", name=imgname, encoding="zlib"):
+                                    for text in image_storage.zlib_encode(self.read(name)):
+                                        xf.write(text)
+                                step(f"Exported {imgname}")
+                if BCMAINFO_MEMBER in self.names():
+                    with xf.element("BcmaInfo"):
+                        xf.write(etree.fromstring(self.read(BCMAINFO_MEMBER)))
+                    step("Exported BcmaInfo")
+                for region, langs in layouts.items():
+                    with xf.element("Region", region=region):
+                        for lang, names in langs.items():
+                            with xf.element("Pages", lang=lang):
+                                with xf.element("Index"):
+                                    xf.write(etree.fromstring(self.read(index_member(region, lang))))
+                                step(f"Exported {region}_{lang} index")
+                                pages = {}
+                                for name in names:
+                                    parts = os.path.splitext(os.path.basename(name))[0].split("_")
+                                    if parts[0] == "Page":
+                                        pages.setdefault(parts[1], []).append((parts[2], parts[3], name))
+                                for page, subpages in pages.items():
+                                    with xf.element("Page", page=page):
+                                        for pagesize, subpage, name in subpages:
+                                            with xf.element("SubPage", pagesize=pagesize, subpage=subpage):
+                                                xf.write(etree.fromstring(self.read(name)))
+                                            step(f"Exported {region}_{lang} page {page} {pagesize} {subpage}")
+
+    def build_bcma(self, out_name, jobs=None, progress=None, cancelled=None):
+        """Builds the .bcma of the project, through a temporary Manual XML next to it.
+        It is only moved to out_name once complete, so out_name is left as it was when cancelled."""
+        folder = os.path.dirname(os.path.abspath(out_name))
+        fd, tmp_xml = tempfile.mkstemp(dir=folder, suffix=".xml")
+        os.close(fd)
+        fd, tmp_bcma = tempfile.mkstemp(dir=folder, suffix=".bcma")
+        os.close(fd)
+        try:
+            self.export_manual(tmp_xml, progress, cancelled)
+            with open(tmp_xml, "rb") as f:
+                bcma = BCMA(f, "", progress, cancelled)
+            with open(tmp_bcma, "wb") as f:
+                bcma.write_to_file(f, jobs, None, progress, cancelled)
+            os.replace(tmp_bcma, out_name)
+        finally:
+            os.remove(tmp_xml)
+            if os.path.exists(tmp_bcma):
+                os.remove(tmp_bcma)
+
+    # the same as ManualIndex, so the page tree and renderer work on projects too
+
+    def regions(self):
+        return list(dict.fromkeys(name.split("/")[1].split("_")[0] for name in self.names() if name.startswith("pages/")))
+
+    def languages(self, region):
+        return list(dict.fromkeys(name.split("/")[1].split("_")[1] for name in self.names() if name.startswith(f"pages/{region}_")))
+
+    def pages(self, region, lang):
+        """Like ManualIndex.pages, but the layouts are functions giving the .bclyt, it is only built from the XML when opened."""
+        index = None
+        pages = {}
+        for name in self.names():
+            if not name.startswith(f"pages/{region}_{lang}/"):
+                continue
+            parts = os.path.splitext(os.path.basename(name))[0].split("_")
+            if parts[0] == "Index":
+                index = functools.partial(self.layout_data, name, 2)
+            else:
+                usd_type = -1 if parts[3] == "info" else 1
+                pages.setdefault(parts[1], []).append((parts[2], parts[3], functools.partial(self.layout_data, name, usd_type)))
+        return index, pages
+
+    def layout_data(self, name, usd_type):
+        out = BytesIO()
+        creation_bclyt.BCLYT(etree.fromstring(self.read(name)), creation_bclyt.BuildContext(usd_type)).write_to_file(out)
+        return out.getvalue()
+
+    def image_arc_names(self):
+        return list(dict.fromkeys(name.split("/")[1] for name in self.names() if name.startswith("images/")))
+
+    def image_names(self, arc_name):
+        # only from the index, nothing is read
+        return [os.path.splitext(os.path.basename(name))[0] for name in self.names() if name.startswith(f"images/{arc_name}/")]
+
+    def image(self, arc_name, name):
+        member = image_member(arc_name, name)
+        return self.read(member) if self.exists(member) else None
+
+    def texture(self, name, region=None, lang=None):
+        for arc_name in texture_arcs(region, lang):
+            data = self.image(arc_name, name)
+            if data is not None:
+                return data
+        return None
@@ -0,0 +1,175 @@
+import os
+import hashlib
+from collections import OrderedDict
+
+from PySide2.QtCore import QObject
+from PySide2.QtCore import QRunnable
+from PySide2.QtCore import QThreadPool
+from PySide2.QtCore import QStandardPaths
+from PySide2.QtCore import Signal
+from PySide2.QtCore import Slot
+from PySide2.QtCore import Qt
+from PySide2.QtGui import QImage
+from PySide2.QtGui import QPixmap
+
+from internal.extraction import BCLIM
+
+THUMBNAIL_SIZE = 64
+DEFAULT_MEMORY_SIZE = 128 * 1024 * 1024
+DEFAULT_DISK_SIZE = 256 * 1024 * 1024
+# the disk cache is trimmed after this many textures were loaded, rather than scanning its folder after each one
+DISK_EVICT_INTERVAL = 32
+
+def default_folder():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "textures")
+
+class TextureJobSignals(QObject):
+    done = Signal(object, object, object)
+    failed = Signal(object, str)
+
+class TextureJob(QRunnable):
+    """Loads the decoded texture and its thumbnail from the disk cache, or decodes the BCLIM and stores them there.
+    Runs on the thread pool, so it only deals in QImage, the pixmaps are made back on the GUI thread."""
+    def __init__(self, key, data, folder):
+        super(TextureJob, self).__init__()
+        self.key = key
+        self.data = data
+        self.folder = folder
+        self.signals = TextureJobSignals()
+
+    def run(self):
+        try:
+            image, thumbnail = self.load()
+        except Exception as e:
+            self.signals.failed.emit(self.key, str(e))
+            return
+        self.signals.done.emit(self.key, image, thumbnail)
+
+    def load(self):
+        name, digest = self.key
+        image_path = os.path.join(self.folder, digest + ".png")
+        thumbnail_path = os.path.join(self.folder, digest + "_thumb.png")
+        image = QImage(image_path)
+        thumbnail = QImage(thumbnail_path)
+        if not image.isNull() and not thumbnail.isNull():
+            # the modification time is what eviction orders by
+            os.utime(image_path)
+            os.utime(thumbnail_path)
+            return image, thumbnail
+
+        rgba = BCLIM(self.data).to_rgba().copy()
+        height, width = rgba.shape[:2]
+        # copy so the image owns its pixels once the array is gone
+        image = QImage(rgba.data, width, height, width * 4, QImage.Format_RGBA8888).copy()
+        thumbnail = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        os.makedirs(self.folder, exist_ok=True)
+        image.save(image_path, "PNG")
+        thumbnail.save(thumbnail_path, "PNG")
+        return image, thumbnail
+
+class TextureCache(QObject):
+    """Decoded textures and their thumbnails, keyed by image name and hash of the BCLIM.
+    The least recently used ones are dropped past memory_size bytes, and they are kept as PNG on disk
+    between sessions, up to disk_size bytes. Missing ones are loaded on a thread pool, textureReady is emitted
+    with the name and key once they are available, so nothing ever blocks the GUI."""
+    textureReady = Signal(str, object)
+    textureFailed = Signal(str, str)
+
+    def __init__(self, folder=None, memory_size=DEFAULT_MEMORY_SIZE, disk_size=DEFAULT_DISK_SIZE, pool=None, parent=None):
+        super(TextureCache, self).__init__(parent)
+        self.folder = default_folder() if folder is None else folder
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.pool = QThreadPool.globalInstance() if pool is None else pool
+        self.entries = OrderedDict()
+        self.size = 0
+        self.pending = {}
+        # keys that could not be decoded, they are not tried again
+        self.failed = set()
+        self.loaded = 0
+        self.evict_disk()
+
+    def key(self, name, data):
+        return name, hashlib.sha1(data).hexdigest()
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def request(self, name, data):
+        """Returns the key of the texture, and whether it is already available through pixmap and thumbnail.
+        If not, it starts loading and textureReady is emitted later."""
+        key = self.key(name, data)
+        if self.lookup(key) is not None:
+            return key, True
+        if key in self.failed:
+            return key, False
+        if key not in self.pending:
+            job = TextureJob(key, bytes(data), self.folder)
+            job.signals.done.connect(self.job_done)
+            job.signals.failed.connect(self.job_failed)
+            # the job must be kept alive until it reports back
+            self.pending[key] = job
+            self.pool.start(job)
+        return key, False
+
+    def pixmap(self, key):
+        entry = self.lookup(key)
+        return None if entry is None else entry[0]
+
+    def thumbnail(self, key):
+        entry = self.lookup(key)
+        return None if entry is None else entry[1]
+
+    @Slot(object, object, object)
+    def job_done(self, key, image, thumbnail):
+        self.pending.pop(key, None)
+        entry = (QPixmap.fromImage(image), QPixmap.fromImage(thumbnail), image.sizeInBytes() + thumbnail.sizeInBytes())
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[2]
+        self.entries[key] = entry
+        self.size += entry[2]
+        self.evict_memory()
+        self.loaded += 1
+        if self.loaded >= DISK_EVICT_INTERVAL:
+            self.loaded = 0
+            self.evict_disk()
+        self.textureReady.emit(key[0], key)
+
+    @Slot(object, str)
+    def job_failed(self, key, message):
+        self.pending.pop(key, None)
+        self.failed.add(key)
+        self.textureFailed.emit(key[0], message)
+
+    def evict_memory(self):
+        # the newest entry always stays, even if it alone is over the limit
+        while self.size > self.memory_size and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            self.size -= entry[2]
+
+    def evict_disk(self):
+        if not os.path.isdir(self.folder):
+            return
+        entries = []
+        total = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.endswith(".png"):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, p in entries:
+            if total <= self.disk_size:
+                break
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
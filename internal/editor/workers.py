@@ -0,0 +1,42 @@
+import threading
+
+from PySide2.QtCore import QObject
+from PySide2.QtCore import QRunnable
+from PySide2.QtCore import Signal
+
+from internal.creation import Cancelled
+
+class WorkerSignals(QObject):
+    progress = Signal(int, int, str)
+    finished = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+class Worker(QRunnable):
+    """Runs function(*args, progress=..., cancelled=..., **kwargs) on a thread pool, like the library functions taking those.
+    The signals are emitted from the pool thread, the connected slots of the window run on the GUI thread."""
+    def __init__(self, function, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.stop = threading.Event()
+
+    def cancel(self):
+        # the function stops at its next check, raising Cancelled
+        self.stop.set()
+
+    def report(self, done, total, message):
+        self.signals.progress.emit(done, total, message)
+
+    def run(self):
+        try:
+            result = self.function(*self.args, progress=self.report, cancelled=self.stop.is_set, **self.kwargs)
+        except Cancelled:
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(result)
@@ -1,5 +1,5 @@
-from .darc import DARC
+from .darc import DARC, LazyDARC
 from .bclyt import BCLYT
 from .bclim import BCLIM
 
-__all__ = ("DARC", "BCLYT", "BCLIM")
+__all__ = ("DARC", "LazyDARC", "BCLYT", "BCLIM")
@@ -1,6 +1,232 @@
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from .readerthingy import ReaderThingy
 from internal import usefulenums
 
+# info sources:
+# https://www.3dbrew.org/wiki/CLIM
+# https://www.khronos.org/registry/OpenGL/extensions/OES/OES_compressed_ETC1_RGB8_texture.txt
+
+ETC1_MODIFIERS = (
+    (2, 8, -2, -8),
+    (5, 17, -5, -17),
+    (9, 29, -9, -29),
+    (13, 42, -13, -42),
+    (18, 60, -18, -60),
+    (24, 80, -24, -80),
+    (33, 106, -33, -106),
+    (47, 183, -47, -183),
+)
+
+# bits per pixel of each format
+FORMAT_BITS = {
+    usefulenums.ImageFormats.L8: 8,
+    usefulenums.ImageFormats.A8: 8,
+    usefulenums.ImageFormats.LA4: 8,
+    usefulenums.ImageFormats.LA8: 16,
+    usefulenums.ImageFormats.HILO8: 16,
+    usefulenums.ImageFormats.RGB565: 16,
+    usefulenums.ImageFormats.RGB8: 24,
+    usefulenums.ImageFormats.RGB5A1: 16,
+    usefulenums.ImageFormats.RGBA4: 16,
+    usefulenums.ImageFormats.RGBA8: 32,
+    usefulenums.ImageFormats.ETC1: 4,
+    usefulenums.ImageFormats.ETC1A4: 8,
+    usefulenums.ImageFormats.L4: 4,
+    usefulenums.ImageFormats.A4: 4,
+}
+
+def stored_size(width, height, fmt, data_size):
+    # the textures are usually padded to powers of 2 (at least 8), but not always
+    padded = [max(8, 1 << (x - 1).bit_length()) for x in (width, height)]
+    tiled = [(x + 7) & ~7 for x in (width, height)]
+    for w, h in (padded, tiled):
+        if w * h * FORMAT_BITS[fmt] // 8 == data_size:
+            return w, h
+    return padded
+
+@lru_cache(maxsize=None)
+def morton_order(width, height):
+    """For each pixel in the order they are stored, its index in the row major image.
+    The image is made of 8x8 tiles left to right then top to bottom, the pixels of a tile are in Z order."""
+    i = np.arange(64)
+    # x is made of the even bits, y of the odd bits
+    x = (i & 1) | ((i >> 1) & 2) | ((i >> 2) & 4)
+    y = ((i >> 1) & 1) | ((i >> 2) & 2) | ((i >> 3) & 4)
+    tiles_x = np.arange(0, width, 8)
+    tiles_y = np.arange(0, height, 8)
+    x = (tiles_x[None, :, None] + x[None, None, :])
+    y = (tiles_y[:, None, None] + y[None, None, :])
+    order = (y * width + x).reshape(-1)
+    order.flags.writeable = False
+    return order
+
+def expand(values, bits):
+    # scales a bits wide channel to 0-255, repeating the high bits in the low ones
+    values = values.astype(np.uint16)
+    out = values << (8 - bits)
+    shift = bits
+    while shift < 8:
+        out |= out >> shift
+        shift *= 2
+    return out.astype(np.uint8)
+
+def unpack_pixels(raw, fmt, count):
+    """Pixels in storage order as a (count, 4) RGBA array, for every format but the ETC1 ones."""
+    F = usefulenums.ImageFormats
+    out = np.empty((count, 4), dtype=np.uint8)
+    if fmt in (F.L4, F.A4):
+        b = raw[:count // 2]
+        values = np.empty(count, dtype=np.uint8)
+        # the low nibble is the first pixel
+        values[0::2] = b & 0xF
+        values[1::2] = b >> 4
+        values = values * 17
+        if fmt == F.L4:
+            out[:, 0:3] = values[:, None]
+            out[:, 3] = 0xFF
+        else:
+            out[:, 0:3] = 0xFF
+            out[:, 3] = values
+        return out
+
+    bpp = FORMAT_BITS[fmt] // 8
+    b = raw[:count * bpp].reshape(count, bpp)
+    if fmt == F.RGBA8:
+        out[:] = b[:, ::-1]
+    elif fmt == F.RGB8:
+        out[:, 0:3] = b[:, ::-1]
+        out[:, 3] = 0xFF
+    elif fmt == F.L8:
+        out[:, 0:3] = b
+        out[:, 3] = 0xFF
+    elif fmt == F.A8:
+        out[:, 0:3] = 0xFF
+        out[:, 3] = b[:, 0]
+    elif fmt == F.LA8:
+        out[:, 0:3] = b[:, 1:2]
+        out[:, 3] = b[:, 0]
+    elif fmt == F.HILO8:
+        out[:, 0] = b[:, 1]
+        out[:, 1] = b[:, 0]
+        out[:, 2] = 0
+        out[:, 3] = 0xFF
+    elif fmt == F.LA4:
+        out[:, 0:3] = ((b[:, 0] >> 4) * 17)[:, None]
+        out[:, 3] = (b[:, 0] & 0xF) * 17
+    else:
+        v = b[:, 0].astype(np.uint16) | (b[:, 1].astype(np.uint16) << 8)
+        if fmt == F.RGB565:
+            out[:, 0] = expand(v >> 11, 5)
+            out[:, 1] = expand((v >> 5) & 0x3F, 6)
+            out[:, 2] = expand(v & 0x1F, 5)
+            out[:, 3] = 0xFF
+        elif fmt == F.RGB5A1:
+            out[:, 0] = expand(v >> 11, 5)
+            out[:, 1] = expand((v >> 6) & 0x1F, 5)
+            out[:, 2] = expand((v >> 1) & 0x1F, 5)
+            out[:, 3] = (v & 1) * 0xFF
+        elif fmt == F.RGBA4:
+            out[:, 0] = expand(v >> 12, 4)
+            out[:, 1] = expand((v >> 8) & 0xF, 4)
+            out[:, 2] = expand((v >> 4) & 0xF, 4)
+            out[:, 3] = expand(v & 0xF, 4)
+        else:
+            raise ValueError(f"Unsupported image format: {fmt}")
+    return out
+
+def decode_etc1_blocks(blocks):
+    """RGB of the 16 pixels of each ETC1 block, as a (count, 16, 3) array in the order of the pixel indexes (x * 4 + y).
+    blocks are the 64-bit words of the blocks, which the 3DS stores little endian."""
+    v = blocks
+    differential = ((v >> 33) & 1).astype(bool)
+    flip = ((v >> 32) & 1).astype(bool)
+
+    bases = []
+    for shift in (59, 51, 43):
+        # individual mode: two 4-bit colors
+        c1 = ((v >> (shift + 1)) & 0xF).astype(np.int16)
+        c2 = ((v >> (shift - 3)) & 0xF).astype(np.int16)
+        ind1 = (c1 << 4) | c1
+        ind2 = (c2 << 4) | c2
+        # differential mode: a 5-bit color and a signed 3-bit difference to it
+        d1 = ((v >> shift) & 0x1F).astype(np.int16)
+        delta = ((v >> (shift - 3)) & 0x7).astype(np.int16)
+        d2 = (d1 + ((delta ^ 4) - 4)) & 0x1F
+        diff1 = (d1 << 3) | (d1 >> 2)
+        diff2 = (d2 << 3) | (d2 >> 2)
+        bases.append((np.where(differential, diff1, ind1), np.where(differential, diff2, ind2)))
+    base1 = np.stack([b[0] for b in bases], axis=-1)
+    base2 = np.stack([b[1] for b in bases], axis=-1)
+
+    modifiers = np.array(ETC1_MODIFIERS, dtype=np.int16)
+    table1 = modifiers[((v >> 37) & 7).astype(np.intp)]
+    table2 = modifiers[((v >> 34) & 7).astype(np.intp)]
+
+    p = np.arange(16, dtype=np.uint64)
+    msb = ((v[:, None] >> (p + np.uint64(16))) & 1).astype(np.intp)
+    lsb = ((v[:, None] >> p) & 1).astype(np.intp)
+    index = (msb << 1) | lsb
+
+    # pixel p is at x = p // 4, y = p % 4, the block is split in two vertically, or horizontally when flipped
+    px = np.arange(16) // 4
+    py = np.arange(16) % 4
+    second = np.where(flip[:, None], py[None, :] >= 2, px[None, :] >= 2)
+
+    rows = np.arange(len(v))[:, None]
+    modifier = np.where(second, table2[rows, index], table1[rows, index])
+    base = np.where(second[:, :, None], base2[:, None, :], base1[:, None, :])
+    return np.clip(base + modifier[:, :, None], 0, 255).astype(np.uint8)
+
+def decode_etc1(raw, width, height, alpha):
+    """ETC1(A4) data as a (height, width, 4) RGBA array, in the stored (upside down) orientation."""
+    count = (width // 4) * (height // 4)
+    words = raw[:count * (16 if alpha else 8)].view("<u8")
+    if alpha:
+        alphas = words[0::2]
+        colors = words[1::2]
+    else:
+        colors = words
+
+    out = np.empty((count, 16, 4), dtype=np.uint8)
+    out[:, :, 0:3] = decode_etc1_blocks(colors.astype(np.uint64))
+    if alpha:
+        nibbles = (alphas[:, None] >> (np.arange(16, dtype=np.uint64) * np.uint64(4))) & 0xF
+        out[:, :, 3] = nibbles.astype(np.uint8) * 17
+    else:
+        out[:, :, 3] = 0xFF
+
+    # pixel indexes are x * 4 + y, make the blocks row major
+    out = out.reshape(count, 4, 4, 4).transpose(0, 2, 1, 3)
+    # the 4 blocks of each 8x8 tile are in Z order, the tiles are row major
+    out = out.reshape(height // 8, width // 8, 2, 2, 4, 4, 4)
+    out = out.transpose(0, 2, 4, 1, 3, 5, 6)
+    return out.reshape(height, width, 4)
+
+def decode(data, width, height, fmt):
+    """Decodes the raw texture data of a width x height image in format fmt (an ImageFormats)
+    to a (height, width, 4) uint8 RGBA array, top row first."""
+    if np is None:
+        raise ImportError("decoding textures requires numpy")
+    fmt = usefulenums.ImageFormats(fmt)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    data_size = len(raw)
+    w, h = stored_size(width, height, fmt, data_size)
+    if fmt in (usefulenums.ImageFormats.ETC1, usefulenums.ImageFormats.ETC1A4):
+        image = decode_etc1(raw, w, h, fmt == usefulenums.ImageFormats.ETC1A4)
+    else:
+        pixels = unpack_pixels(raw, fmt, w * h)
+        image = np.empty((w * h, 4), dtype=np.uint8)
+        image[morton_order(w, h)] = pixels
+        image = image.reshape(h, w, 4)
+    # the first stored row is the bottom one
+    return image[::-1][:height, :width]
+
 class BCLIM(ReaderThingy):
     def __init__(self, data, s=0, e=None):
         end = len(data) if e is None else e
@@ -15,5 +241,9 @@ class BCLIM(ReaderThingy):
         revision, filesize, datablocks, pad = self.read_format("2I2H")
 
         assert(self.read_format("4s") == b"imag")
-        parseinfo, w, h, fileformat = self.read_format("I2HI")
-        print("CLIM parseinfo width height format:", parseinfo,  w, h, usefulenums.ImageFormats(fileformat), sep="\n- ")
+        parseinfo, self.data.width, self.data.height, fileformat = self.read_format("I2HI")
+        self.data.format = usefulenums.ImageFormats(fileformat)
+        self.data.size = self.read_format("I")
+
+    def to_rgba(self):
+        return decode(self.view[:self.data.size], self.data.width, self.data.height, self.data.format)
@@ -51,22 +51,34 @@ def attr_control(data):
     out.append(outattrs)
     return out
 
+def split_color(number):
+    data = DataHolder()
+    data.r = (number & (0xFF << (8 * 0))) >> (8 * 0)
+    data.g = (number & (0xFF << (8 * 1))) >> (8 * 1)
+    data.b = (number & (0xFF << (8 * 2))) >> (8 * 2)
+    data.a = (number & (0xFF << (8 * 3))) >> (8 * 3)
+    return data
+
+class Palette:
+    # the colors of one layout, in order of first use, keyed by their packed 32-bit value
+    def __init__(self):
+        self.indexes = {}
+        self.colors = []
+
+    def color(self, number):
+        index = self.indexes.get(number)
+        if index is None:
+            index = self.indexes[number] = len(self.colors)
+            self.colors.append(number)
+        return RGBA(number, index)
+
 class RGBA:
-    MAPPED_COLORS = []
-    def __init__(self, number):
-        data = DataHolder()
-        data.r = (number & (0xFF << (8 * 0))) >> (8 * 0)
-        data.g = (number & (0xFF << (8 * 1))) >> (8 * 1)
-        data.b = (number & (0xFF << (8 * 2))) >> (8 * 2)
-        data.a = (number & (0xFF << (8 * 3))) >> (8 * 3)
-        try:
-            self.index = RGBA.MAPPED_COLORS.index(data)
-        except:
-            self.index = len(RGBA.MAPPED_COLORS)
-            self.MAPPED_COLORS.append(data)
+    def __init__(self, number, index):
+        self.number = number
+        self.index = index
 
     def __str__(self):
-        return "RGBA({})".format(RGBA.MAPPED_COLORS[self.index])
+        return "RGBA({})".format(split_color(self.number))
 
     def __repr__(self):
         return str(self)
@@ -153,16 +165,7 @@ class Fnl1(ReaderThingy):
         font_offsets = self.read_format("{}I".format(number_fonts), False)
         self.data.font_names = []
         for off in font_offsets:
-            namoff = off + font_start_off
-            name = []
-            while True:
-                c = self.read_off("1s", namoff)
-                namoff += 1
-                if c == b'\x00':
-                    self.data.font_names.append("".join(name))
-                    break
-                else:
-                    name.append(c.decode('ascii'))
+            self.data.font_names.append(self.read_string(off + font_start_off, "ascii"))
 
 class Txl1(ReaderThingy):
     def __init__(self, bclyt, data, s=0, e=None):
@@ -174,16 +177,7 @@ class Txl1(ReaderThingy):
         textures_offsets = self.read_format("{}I".format(number_textures), False)
         self.data.texture_names = []
         for off in textures_offsets:
-            namoff = off + textures_start_off
-            name = []
-            while True:
-                c = self.read_off("1s", namoff)
-                namoff += 1
-                if c == b'\x00':
-                    self.data.texture_names.append(b"".join(name).decode("utf-8"))
-                    break
-                else:
-                    name.append(c)
+            self.data.texture_names.append(self.read_string(off + textures_start_off))
 
 class TexMapEntry:
     def __init__(self, parent):
@@ -211,9 +205,9 @@ class TexMatrixEntry:
 class TexCoordGen:
     def __init__(self, parent):
         self.data = DataHolder()
-        self.data.gen_type = usefulenums.MatrixType(parent.read_format("B")).name
-        self.data.source = usefulenums.TextureGenerationType(parent.read_format("B")).name
-        parent.read_format("2x")
+        gen_type, source = parent.read_format("2B2x")
+        self.data.gen_type = usefulenums.MatrixType(gen_type).name
+        self.data.source = usefulenums.TextureGenerationType(source).name
 
     def to_xml(self):
         return GenXML.TexCoordGen(*attr_control(self.data))
@@ -253,8 +247,8 @@ class AlphaBlendMode(BlendMode):
 class IndirectParam:
     def __init__(self, parent):
         self.data = DataHolder()
-        self.data.rotation = parent.read_format("f")
-        self.data.scale = Vec2(*parent.read_format("2f"))
+        self.data.rotation, sx, sy = parent.read_format("3f")
+        self.data.scale = Vec2(sx, sy)
 
     def to_xml(self):
         return GenXML.IndirectParam(*attr_control(self.data))
@@ -262,9 +256,9 @@ class IndirectParam:
 class ProjTexGenParam:
     def __init__(self, parent):
         self.data = DataHolder()
-        self.data.pos = Vec2(*parent.read_format("2f"))
-        self.data.scale = Vec2(*parent.read_format("2f"))
-        flags = parent.read_format("B3x")
+        px, py, sx, sy, flags = parent.read_format("4fB3x")
+        self.data.pos = Vec2(px, py)
+        self.data.scale = Vec2(sx, sy)
         self.data.fits_layout = bool(flags & 0x1)
         self.data.fits_panel = bool(flags & 0x2)
         self.data.adjust_projection_sr = bool(flags & 0x3)
@@ -281,8 +275,8 @@ class FontShadowParam:
         return GenXML.FontShadowParam(*attr_control(self.data))
 
 class TevConstantColors:
-    def __init__(self, colors):
-        self.colors = list(map(RGBA, colors))
+    def __init__(self, palette, colors):
+        self.colors = list(map(palette.color, colors))
 
     def to_xml(self):
         cs = [GenXML.ColorIndex(str(c.index)) for c in self.colors]
@@ -291,10 +285,13 @@ class TevConstantColors:
 class Material:
     def __init__(self, parent):
         self.data = DataHolder()
-        self.data.name = parent.read_format("{}s".format(0x14)).rstrip(b"\x00").decode("utf-8")
-        self.data.tev_color = RGBA(parent.read_format("I"))
-        self.data.tev_constant_colors = TevConstantColors(parent.read_format("6I"))
-        flags = parent.read_format("I")
+        # name, tev color, 6 tev constant colors, flags
+        fields = parent.read_format("20s8I")
+        self.data.name = fields[0].rstrip(b"\x00").decode("utf-8")
+        palette = parent.parent.palette
+        self.data.tev_color = palette.color(fields[1])
+        self.data.tev_constant_colors = TevConstantColors(palette, fields[2:8])
+        flags = fields[8]
         tex_maps_count = flags & 0b11
         tex_matrix_count = (flags >> 2) & 0b11
         tex_coordgen_count = (flags >> 4) & 0b11
@@ -345,16 +342,7 @@ class Usd1_Entry:
     def __init__(self, data):
         start_pos = data.start + data.index
         name_offset = data.read_format("I")
-        name_offset_used = name_offset + start_pos
-        self.name = []
-        while True:
-            c = data.read_off("1s", name_offset_used)
-            name_offset_used += 1
-            if c == b'\x00':
-                self.name = b"".join(self.name).decode("utf-8")
-                break
-            else:
-                self.name.append(c)
+        self.name = data.read_string(name_offset + start_pos)
         data_offset = data.read_format("I")
         setting, datatype = data.read_format("HBx")
         self.datatype = usefulenums.UsdEntryDataType(datatype)
@@ -364,14 +352,10 @@ class Usd1_Entry:
             self.data = data.read_off("{}s".format(setting), data_offset ).rstrip(b"\x00").decode("utf-8")
             # print("Data name:", self.name, "A string of len", setting, ":", self.data)
         elif self.datatype == usefulenums.UsdEntryDataType.Ints:  # ints
-            self.data = []
-            for i in range(setting):
-                self.data.append(data.read_off("i", data_offset + i * 4))
+            self.data = list(data.read_off("{}i".format(setting), data_offset, False))
             # print("Data name:", self.name, setting, "integers:", self.data)
         elif self.datatype == usefulenums.UsdEntryDataType.Floats:  # floats
-            self.data = []
-            for i in range(setting):
-                self.data.append(data.read_off("f", data_offset + i * 4))
+            self.data = list(data.read_off("{}f".format(setting), data_offset, False))
             # print("Data name:", self.name, setting, "floats:", self.data)
 
     def to_xml(self):
@@ -403,21 +387,17 @@ class Pan1(ReaderThingy):
         ReaderThingy.__init__(self, data, s, len(data) if e is None else e, parent=bclyt)
 
     def validate(self):
-        flags, origin, alpha, magnification_flags = self.read_format("4B")
+        flags, origin, alpha, magnification_flags, name, tx, ty, tz, rx, ry, rz, sx, sy, w, h = self.read_format("4B24s3f3f2f2f")
         self.data.flags = usefulenums.PanelFlags(flags).name
         self.data.origin = Vec2(usefulenums.OriginHorizontal((origin >> 6) & 0b11).name, usefulenums.OriginVertical((origin >> 4) & 0b11).name)
         self.data.parent_origin = Vec2(usefulenums.OriginHorizontal((origin >> 2) & 0b11).name, usefulenums.OriginVertical((origin) & 0b11).name)
         self.data.alpha = alpha
         self.data.magnification_flags = usefulenums.PanelMagnificationFlags(magnification_flags).name
-        self.data.name = self.read_format("{}s".format(0x18)).rstrip(b"\x00").decode("utf-8")
-        x, y, z = self.read_format("3f")
-        self.data.translation = Vec3(x, y, z)
-        x, y, z = self.read_format("3f")
-        self.data.rotation = Vec3(x, y, z)
-        x, y = self.read_format("2f")
-        self.data.scale = Vec2(x, y)
-        x, y = self.read_format("2f")
-        self.data.size = Vec2(x, y)
+        self.data.name = name.rstrip(b"\x00").decode("utf-8")
+        self.data.translation = Vec3(tx, ty, tz)
+        self.data.rotation = Vec3(rx, ry, rz)
+        self.data.scale = Vec2(sx, sy)
+        self.data.size = Vec2(w, h)
 
     def __str__(self):
         return "{}({})".format(type(self).__name__, self.data)
@@ -431,8 +411,8 @@ class Pic1(Pan1):
 
     def validate(self):
         Pan1.validate(self)
-        self.data.tl_color, self.data.tr_color, self.data.bl_color, self.data.br_color = map(RGBA, self.read_format("4I"))
-        material_index, texture_coord_count = self.read_format("2H")
+        tl, tr, bl, br, material_index, texture_coord_count = self.read_format("4I2H")
+        self.data.tl_color, self.data.tr_color, self.data.bl_color, self.data.br_color = map(self.parent.palette.color, (tl, tr, bl, br))
         self.data.material_name = self.parent.materials[material_index].data.name
         self.data.texture_coords = [TextureCoords() for i in range(texture_coord_count)]
         for holder in self.data.texture_coords:
@@ -445,18 +425,17 @@ class Txt1(Pan1):
 
     def validate(self):
         Pan1.validate(self)
-        max_size, text_size = self.read_format("2H")
+        (max_size, text_size, material_index, font_index, another_origin, line_alignment, text_offset,
+            top_color, bottom_color, text_w, text_h, character_size, line_size) = self.read_format("4H2B2xI2I4f")
         self.data.additional_chars = (max_size - text_size) >> 1
-        material_index, font_index = self.read_format("2H")
         self.data.material_name = self.parent.materials[material_index].data.name
         self.data.font_name = self.parent.fonts[font_index]
-        another_origin, line_alignment = self.read_format("2B2x")
         self.data.another_origin = Vec2(usefulenums.OriginHorizontal((another_origin >> 2) & 0b11).name, usefulenums.OriginVertical((another_origin) & 0b11).name)
         self.data.line_alignment = usefulenums.LineAlignment(line_alignment).name
-        text_offset = self.read_format("I") + self.start - 8
-        self.data.top_color, self.data.bottom_color = map(RGBA, self.read_format("2I"))
-        self.data.text_size = Vec2(*self.read_format("2f"))
-        self.data.character_size, self.data.line_size = self.read_format("2f")
+        text_offset += self.start - 8
+        self.data.top_color, self.data.bottom_color = self.parent.palette.color(top_color), self.parent.palette.color(bottom_color)
+        self.data.text_size = Vec2(text_w, text_h)
+        self.data.character_size, self.data.line_size = character_size, line_size
         self.data.text = self.read_off("{}s".format(text_size), text_offset).rstrip(b"\x00")
         if len(self.data.text) & 1:
             self.data.text += b"\x00"
@@ -482,11 +461,9 @@ class Wnd1(Pan1):
 
     def validate(self):
         Pan1.validate(self)
-        self.data.content_overflow_l, self.data.content_overflow_r, self.data.content_overflow_t, self.data.content_overflow_b = self.read_format("4f")
-        frame_count, self.data.flag = self.read_format("2B2x")
-        content_offset, frame_offsets_offset = self.read_format("2I")
-        self.data.tl_color, self.data.tr_color, self.data.bl_color, self.data.br_color = map(RGBA, self.read_format("4I"))
-        material_index, uv_set_count = self.read_format("2H")
+        (self.data.content_overflow_l, self.data.content_overflow_r, self.data.content_overflow_t, self.data.content_overflow_b,
+            frame_count, self.data.flag, content_offset, frame_offsets_offset, tl, tr, bl, br, material_index, uv_set_count) = self.read_format("4f2B2x2I4I2H")
+        self.data.tl_color, self.data.tr_color, self.data.bl_color, self.data.br_color = map(self.parent.palette.color, (tl, tr, bl, br))
         self.data.material_name = self.parent.materials[material_index].data.name
         self.data.uvsets = list(map(UVCoordSet, splitarray(self.read_format("{}f".format(8 * uv_set_count)), 8)))
         frame_offsets = self.read_off("{}I".format(frame_count), self.start + frame_offsets_offset - 8, False)
@@ -566,7 +543,7 @@ class GroupWrapper:
 
 class BCLYT(ReaderThingy):
     def __init__(self, data, s=0, e=None):
-        RGBA.MAPPED_COLORS.clear()
+        self.palette = Palette()
         ReaderThingy.__init__(self, data, s, len(data) if e is None else e)
 
     def validate(self):
@@ -697,7 +674,7 @@ class BCLYT(ReaderThingy):
             raise e
     
     def to_xml(self):
-        colors = [GenXML.Color(index=str(i), r=str(c.r), g=str(c.g), b=str(c.b), a=str(c.a)) for i, c in enumerate(RGBA.MAPPED_COLORS)]
+        colors = [GenXML.Color(index=str(i), r=str(c.r), g=str(c.g), b=str(c.b), a=str(c.a)) for i, c in enumerate(map(split_color, self.palette.colors))]
         fonts = [GenXML.Font(f) for f in self.fonts]
         textures = [GenXML.Texture(t) for t in self.textures]
         mats = [m.to_xml() for m in self.materials]
@@ -1,4 +1,6 @@
+import io
 import os
+import mmap
 
 from .readerthingy import ReaderThingy
 
@@ -23,15 +25,7 @@ class DARC(ReaderThingy):
 
             folder = bool(entry.filename_off & 0x01000000)
             namoff = self.data.filetableoff + self.data.tablemetasize + (entry.filename_off & 0x00ffffff)
-
-            name = []
-            while type(name) is not str:
-                c = self.read_off("2s", namoff)
-                namoff += 2
-                if c[0] == 0:
-                    name = b"".join(name).decode('utf-16le')
-                else:
-                    name.append(c)
+            name = self.read_string(namoff, "utf-16le")
 
             if folder:
                 assert(entry.size <= len(self.data.tableentries))
@@ -70,3 +64,82 @@ class DARC(ReaderThingy):
         self.data.files = {}
         self.data.pathroot = ""
         self.analyze_part(2, len(self.data.tableentries))
+
+
+class DARCEntryFile(io.RawIOBase):
+    """Read-only file object over the memoryview of a DARC entry."""
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self.view) - self.pos))
+        b[:n] = self.view[self.pos : self.pos + n]
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = len(self.view) + offset
+        else:
+            raise ValueError("invalid whence ({})".format(whence))
+        if self.pos < 0:
+            raise ValueError("negative seek position {}".format(self.pos))
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+class LazyDARC(DARC):
+    """DARC over anything supporting the buffer protocol (mmap, bytes, memoryview...).
+    Only the table is parsed, the files are memoryview slices of the data and nothing is copied
+    until they are read."""
+    def __init__(self, data):
+        DARC.__init__(self, memoryview(data))
+        # the map made by from_file, closed by close()
+        self.mapping = None
+
+    @classmethod
+    def from_file(cls, f):
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        darc = cls(mapping)
+        darc.mapping = mapping
+        return darc
+
+    def close(self):
+        """Drops the files and unmaps the data if from_file mapped it.
+        Views of the files still held elsewhere keep the map alive, it is then unmapped once they are gone."""
+        self.data.files = {}
+        self.strings = None
+        self.view = None
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                pass
+            self.mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def names(self):
+        return self.data.files.keys()
+
+    def get(self, name):
+        return self.data.files[name]
+
+    def open(self, name):
+        return io.BufferedReader(DARCEntryFile(self.data.files[name]))
@@ -1,24 +1,71 @@
 import struct
+from functools import lru_cache
 
 from internal import dataholder
 
+@lru_cache(maxsize=None)
+def compiled_struct(endian, f):
+    # formats are reused thousands of times per layout, only compile each one once
+    return struct.Struct(endian + f)
+
+class StringTable:
+    """Null-terminated names of one document, each decoded once no matter how often its offset is read."""
+    __slots__ = ["view", "names"]
+
+    def __init__(self, view):
+        self.view = view
+        self.names = {}
+
+    def find(self, o, terminator):
+        # names are short, look for the end in a small window and only grow it when needed
+        size = 64
+        while True:
+            chunk = bytes(self.view[o : o + size])
+            end = chunk.find(terminator)
+            # utf-16 terminators must be aligned on a character
+            while end != -1 and end % len(terminator):
+                end = chunk.find(terminator, end + 1)
+            if end != -1:
+                return chunk[:end]
+            if o + size >= len(self.view):
+                raise ValueError("unterminated string at {}".format(hex(o)))
+            size *= 4
+
+    def get(self, o, encoding="utf-8"):
+        key = (o, encoding)
+        name = self.names.get(key)
+        if name is None:
+            terminator = b"\x00\x00" if encoding == "utf-16le" else b"\x00"
+            name = self.names[key] = self.find(o, terminator).decode(encoding)
+        return name
+
 class ReaderThingy:
-    __slots__ = ["parent", "start", "index", "view", "size", "endian", "data"]
+    __slots__ = ["parent", "start", "index", "view", "size", "endian", "data", "strings"]
 
     def read_off(self, f, o, smolize=True):
-        d = struct.unpack_from(self.endian + f, self.view, o)
+        d = compiled_struct(self.endian, f).unpack_from(self.view, o)
         if smolize and len(d) == 1:
             return d[0]
         else:
             return d
 
     def read_format(self, f, smolize=True):
+        s = compiled_struct(self.endian, f)
         old_index = self.index
-        self.index += struct.calcsize(f)
-        return self.read_off(f, self.start + old_index, smolize)
+        self.index += s.size
+        d = s.unpack_from(self.view, self.start + old_index)
+        if smolize and len(d) == 1:
+            return d[0]
+        else:
+            return d
+
+    def read_string(self, o, encoding="utf-8"):
+        return self.strings.get(o, encoding)
 
     def __init__(self, view, start, size, **kwargs):
         self.parent = kwargs.get("parent", None)
+        # sections share the string table of the layout they are part of
+        self.strings = StringTable(view) if self.parent is None else self.parent.strings
         self.start = start
         self.index = 0
         self.view = view
@@ -0,0 +1,55 @@
+import os
+import zlib
+import base64
+
+from internal import my_rle
+
+# how the .bclim files are stored in the Image elements of the XML:
+# rle: the hex of the file, run length encoded, as the element's text (the original format)
+# zlib: the base64 of the zlib compressed file as the element's text, with encoding="zlib"
+# files: the file is written next to the XML, the element only has its path relative to the XML in file="..."
+MODES = ("rle", "zlib", "files")
+
+# a multiple of 3 bytes, so the base64 of the chunks can simply be concatenated
+CHUNK_SIZE = 3 * 0x10000
+
+def chunks(data, size=CHUNK_SIZE):
+    return (data[i:i+size] for i in range(0, len(data), size))
+
+def rle_encode(data):
+    # yields the text piece by piece, like zlib_encode
+    return my_rle.compress_stream(chunks(memoryview(data)))
+
+def rle_decode(text):
+    return b"".join(my_rle.decompress_stream(chunks(text)))
+
+def zlib_encode(data):
+    # yields the base64 text piece by piece, so it can be written out without ever being whole
+    compressor = zlib.compressobj(9)
+    pending = b""
+    for chunk in chunks(memoryview(data)):
+        pending += compressor.compress(chunk)
+        cut = len(pending) - (len(pending) % 3)
+        if cut:
+            yield base64.b64encode(pending[:cut]).decode("ascii")
+            pending = pending[cut:]
+    pending += compressor.flush()
+    yield base64.b64encode(pending).decode("ascii")
+
+def zlib_decode(text):
+    decompressor = zlib.decompressobj()
+    out = bytearray()
+    for chunk in chunks(text, (CHUNK_SIZE // 3) * 4):
+        out += decompressor.decompress(base64.b64decode(chunk))
+    out += decompressor.flush()
+    return bytes(out)
+
+def load_image(node, folder=""):
+    # folder is where the XML is, sidecar paths are relative to it
+    path = node.get("file")
+    if path is not None:
+        with open(os.path.join(folder, path), "rb") as f:
+            return f.read()
+    if node.get("encoding") == "zlib":
+        return zlib_decode(node.text)
+    return rle_decode(node.text)
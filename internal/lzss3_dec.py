@@ -6,6 +6,11 @@ from os import SEEK_SET, SEEK_CUR, SEEK_END
 from errno import EPIPE
 from struct import pack, unpack
 
+try:
+    from nlzss3 import decompress_into as native_decompress_into, error as NativeError
+except ImportError:
+    native_decompress_into = None
+
 __all__ = ('decompress', "decompress_raw_lzss10", 'decompress_file', 'decompress_bytes',
            'DecompressionError')
 
@@ -69,6 +74,16 @@ def decompress_raw_lzss10(indata, decompressed_size, _overlay=False):
 
     return data
 
+def decompress_native(data, decompressed_size):
+    """Decompress LZSS-compressed bytes (header included) with the nlzss3 extension.
+    Returns a bytearray."""
+    out = bytearray(decompressed_size)
+    try:
+        native_decompress_into(data, out)
+    except NativeError as e:
+        raise DecompressionError(str(e)) from e
+    return out
+
 def decompress(obj):
     """Decompress LZSS-compressed bytes or a file-like object.
 
@@ -83,7 +98,7 @@ def decompress(obj):
 
 def decompress_bytes(data):
     """Decompress LZSS-compressed bytes. Returns a bytearray."""
-    header = data[:4]
+    header = bytes(data[:4])
     if header[0] == 0x10:
         decompress_raw = decompress_raw_lzss10
     else:
@@ -91,6 +106,9 @@ def decompress_bytes(data):
 
     decompressed_size, = unpack("<L", header[1:] + b'\x00')
 
+    if native_decompress_into is not None:
+        return decompress_native(data, decompressed_size)
+
     data = data[4:]
     return decompress_raw(data, decompressed_size)
 
@@ -109,4 +127,7 @@ def decompress_file(f):
     decompressed_size, = unpack("<L", header[1:] + b'\x00')
 
     data = f.read()
+    if native_decompress_into is not None:
+        return decompress_native(header + data, decompressed_size)
+
     return decompress_raw(data, decompressed_size)
@@ -1,44 +1,147 @@
+import re
+
 hex_start_set = "0123456789abcdef"
 alpha_end_set = "ABCDEFGHIJKLMNOP"
 convert_to_alpha = str.maketrans(hex_start_set, alpha_end_set)
 convert_to_hex = str.maketrans(alpha_end_set, hex_start_set)
+# the text of a hand edited or pretty printed XML may be wrapped or indented
+drop_whitespace = str.maketrans("", "", " \t\n\r\f\v")
+
+# runs of 2 or more of the same character, and a count followed by the character it repeats
+repeated_run = re.compile(r"(.)\1+", re.DOTALL)
+counted_run = re.compile(r"([0-9]+)([^0-9])")
+
+def encode_run(m):
+    return str(len(m.group())) + m.group(1)
+
+def decode_run(m):
+    return m.group(2) * int(m.group(1))
 
 def do_compression(data):
-    out = []
-    data = data.translate(convert_to_alpha)
+    return repeated_run.sub(encode_run, data.translate(convert_to_alpha))
+
+def do_decompression(compressed):
+    return counted_run.sub(decode_run, compressed).translate(convert_to_hex)
 
+def compress_stream(chunks):
+    """Yields the compression of the hex of the bytes-like chunks piece by piece,
+    together the same as do_compression of the hex of all of them."""
+    previous = ""
     duration = 0
-    previous = data[0]
-    for c in data:
-        if c != previous:
-            if duration != 1:
-                out.append(str(duration))
-            out.append(previous)
-            duration = 1
-            previous = c
-        else:
-            duration += 1
-
-    if duration != 1:
-        out.append(str(duration))
-    out.append(previous)
-
-    return "".join(out)
+    for chunk in chunks:
+        text = chunk.hex().translate(convert_to_alpha)
+        if not len(text):
+            continue
+        if len(previous):
+            # the run at the end of the previous chunk may go on in this one
+            rest = text.lstrip(previous)
+            duration += len(text) - len(rest)
+            if not len(rest):
+                continue
+            yield previous if duration == 1 else str(duration) + previous
+            text = rest
+        # keep the last run for the next chunk
+        body = text.rstrip(text[-1])
+        previous = text[-1]
+        duration = len(text) - len(body)
+        if len(body):
+            yield repeated_run.sub(encode_run, body)
+    if len(previous):
+        yield previous if duration == 1 else str(duration) + previous
 
-def do_decompression(compressed):
-    out = []
-    num = []
-    for c in compressed:
-        if c.isdigit():
-            num.append(c)
-        else:
-            character = c
-            if len(num) != 0:
-                duration = int("".join(num))
-                num.clear()
-                out.append(character * duration)
+def decompress_stream(pieces):
+    """Yields the bytes of the compressed text given piece by piece, whitespace in it is skipped."""
+    count = ""
+    nibble = ""
+    for piece in pieces:
+        text = count + piece.translate(drop_whitespace)
+        # a count at the end goes with the character at the start of the next piece
+        body = text.rstrip(hex_start_set[:10])
+        count = text[len(body):]
+        hexdigits = nibble + counted_run.sub(decode_run, body).translate(convert_to_hex)
+        cut = len(hexdigits) & ~1
+        nibble = hexdigits[cut:]
+        yield bytes.fromhex(hexdigits[:cut])
+    if len(count):
+        raise ValueError("RLE data ends with a count but no character")
+    if len(nibble):
+        raise ValueError("RLE data ends in the middle of a byte")
+
+if __name__ == "__main__":
+    # python -m internal.my_rle [files...]: checks against the original loops and times both
+    import os
+    import sys
+    import time
+
+    def loop_compression(data):
+        out = []
+        data = data.translate(convert_to_alpha)
+
+        duration = 0
+        previous = data[0]
+        for c in data:
+            if c != previous:
+                if duration != 1:
+                    out.append(str(duration))
+                out.append(previous)
+                duration = 1
+                previous = c
             else:
-                out.append(character)
-    out = "".join(out)
-    out = out.translate(convert_to_hex)
-    return out
+                duration += 1
+
+        if duration != 1:
+            out.append(str(duration))
+        out.append(previous)
+
+        return "".join(out)
+
+    def loop_decompression(compressed):
+        out = []
+        num = []
+        for c in compressed:
+            if c.isdigit():
+                num.append(c)
+            else:
+                character = c
+                if len(num) != 0:
+                    duration = int("".join(num))
+                    num.clear()
+                    out.append(character * duration)
+                else:
+                    out.append(character)
+        out = "".join(out)
+        out = out.translate(convert_to_hex)
+        return out
+
+    def timed(f, *args):
+        start = time.perf_counter()
+        result = f(*args)
+        return result, time.perf_counter() - start
+
+    if len(sys.argv) > 1:
+        samples = []
+        for fn in sys.argv[1:]:
+            with open(fn, "rb") as f:
+                samples.append((fn, f.read()))
+    else:
+        # mostly flat areas with some noise, like the textures
+        samples = [("synthetic", b"".join(bytes([i & 0xff]) * (i % 37) + os.urandom(i % 5) for i in range(40000)))]
+
+    for name, raw in samples:
+        hexdata = raw.hex()
+        expected, loop_c = timed(loop_compression, hexdata)
+        compressed, new_c = timed(do_compression, hexdata)
+        assert(compressed == expected)
+        streamed = "".join(compress_stream(raw[i:i+4099] for i in range(0, len(raw), 4099)))
+        assert(streamed == expected)
+
+        decompressed, loop_d = timed(loop_decompression, compressed)
+        assert(decompressed == hexdata)
+        decompressed, new_d = timed(do_decompression, compressed)
+        assert(decompressed == hexdata)
+        assert(b"".join(decompress_stream(compressed[i:i+4099] for i in range(0, len(compressed), 4099))) == raw)
+        # wrapped and indented like a pretty printed XML, lines may split a count from its character
+        wrapped = "\n      " + "\n      ".join(compressed[i:i+76] for i in range(0, len(compressed), 76)) + "\n    "
+        assert(b"".join(decompress_stream(wrapped[i:i+4099] for i in range(0, len(wrapped), 4099))) == raw)
+
+        print(f"{name}: {len(raw)} bytes, compression {loop_c:.3f}s -> {new_c:.3f}s, decompression {loop_d:.3f}s -> {new_d:.3f}s, identical output")
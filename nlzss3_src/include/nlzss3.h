@@ -42,13 +42,28 @@
                                  // * flags, (RAW_MAXIM + 7) / 8
                                  // 4 + 0x00FFFFFF + 0x00200000 + padding
 
+#define LZS_BOUND(raw_len) (4 + (raw_len) + (((raw_len) + 7) / 8))
+                                 // worst case compressed size, every byte a literal
 
-void *LZSS_Compress(const unsigned char *inbuffer, Py_ssize_t insize, Py_ssize_t *outsize);
+#define LZS_OK                0  // LZS_Decode return values
+#define LZS_ERR_TRUNCATED    -1  // compressed data ended too early
+#define LZS_ERR_DISPLACEMENT -2  // back-reference before the start of the output
+#define LZS_ERR_OVERRUN      -3  // back-reference past the end of the output
 
+typedef struct {                 // match tree, one per compression call
+    unsigned char ring[LZS_N + LZS_F - 1];
+    int           dad[LZS_N + 1], lson[LZS_N + 1], rson[LZS_N + 1 + 256];
+    int           pos_ring, len_ring;
+} LZS_State;
 
-unsigned char *LZS_Fast(unsigned char *raw_buffer, unsigned int raw_len, unsigned int *new_len);
-void  LZS_InitTree(void);
-void  LZS_InsertNode(int r);
-void  LZS_DeleteNode(int p);
+
+Py_ssize_t LZSS_Compress(const unsigned char *inbuffer, Py_ssize_t insize, unsigned char *outbuffer);
+
+
+unsigned int LZS_Fast(LZS_State *st, const unsigned char *raw_buffer, unsigned int raw_len, unsigned char *pak_buffer);
+int   LZS_Decode(const unsigned char *pak_buffer, Py_ssize_t pak_len, unsigned char *raw_buffer, Py_ssize_t raw_len);
+void  LZS_InitTree(LZS_State *st);
+void  LZS_InsertNode(LZS_State *st, int r);
+void  LZS_DeleteNode(LZS_State *st, int p);
 
 #endif /* INCLUDE_LZSS_H */
@@ -23,45 +23,45 @@
 #include <string.h>
 #include <stdint.h>
 
-/*----------------------------------------------------------------------------*/
-unsigned char ring[LZS_N + LZS_F - 1];
-int           dad[LZS_N + 1], lson[LZS_N + 1], rson[LZS_N + 1 + 256];
-int           pos_ring, len_ring;
-
 /* ----------------------------------------------------------------------------*/
+/* does not touch any Python object, safe to call with the GIL released        */
+/* outbuffer must hold at least LZS_BOUND(insize) bytes                        */
+/* returns the compressed size, or -1 if the state could not be allocated      */
 
-void *LZSS_Compress(const unsigned char *inbuffer, Py_ssize_t insize, Py_ssize_t *outsize)
+Py_ssize_t LZSS_Compress(const unsigned char *inbuffer, Py_ssize_t insize, unsigned char *outbuffer)
 {
-	unsigned int new_len = 0;
-	void *out = LZS_Fast(inbuffer, insize, &new_len);
-	*outsize = new_len;
-	return out;
+	LZS_State *st = PyMem_RawMalloc(sizeof(LZS_State));
+	if (!st) return -1;
+	Py_ssize_t outsize = LZS_Fast(st, inbuffer, insize, outbuffer);
+	PyMem_RawFree(st);
+	return outsize;
 }
 
-unsigned char *LZS_Fast(unsigned char *raw_buffer, unsigned int raw_len, unsigned int *new_len) {
-    unsigned char *pak_buffer, *pak, *raw, *raw_end, *flg;
-    unsigned int   pak_len, len, r, s, len_tmp, i;
+unsigned int LZS_Fast(LZS_State *st, const unsigned char *raw_buffer, unsigned int raw_len, unsigned char *pak_buffer) {
+    unsigned char *pak, *flg;
+    const unsigned char *raw, *raw_end;
+    unsigned int   len, r, s, len_tmp, i;
     unsigned char  mask;
 
-    pak_len = 4 + raw_len + ((raw_len + 7) / 8);
-    pak_buffer = (unsigned char *) PyMem_Calloc(pak_len, sizeof(char));
-
-    *(unsigned int *)pak_buffer = CMD_CODE_10 | (raw_len << 8);
+    pak_buffer[0] = CMD_CODE_10;
+    pak_buffer[1] = raw_len & 0xFF;
+    pak_buffer[2] = (raw_len >> 8) & 0xFF;
+    pak_buffer[3] = (raw_len >> 16) & 0xFF;
 
     pak = pak_buffer + 4;
     raw = raw_buffer;
     raw_end = raw_buffer + raw_len;
 
-    LZS_InitTree();
+    LZS_InitTree(st);
 
     r = s = 0;
 
     len = raw_len < LZS_F ? raw_len : LZS_F;
-    while (r < LZS_N - len) ring[r++] = 0;
+    while (r < LZS_N - len) st->ring[r++] = 0;
 
-    for (i = 0; i < len; i++) ring[r + i] = *raw++;
+    for (i = 0; i < len; i++) st->ring[r + i] = *raw++;
 
-    LZS_InsertNode(r);
+    LZS_InsertNode(st, r);
 
     flg = pak;
     mask = 0;
@@ -72,127 +72,168 @@ unsigned char *LZS_Fast(unsigned char *raw_buffer, unsigned int raw_len, unsigne
             mask = LZS_MASK;
         }
 
-        if (len_ring > len) len_ring = len;
+        if (st->len_ring > len) st->len_ring = len;
 
-        if (len_ring > LZS_THRESHOLD) {
+        if (st->len_ring > LZS_THRESHOLD) {
             *flg |= mask;
-            pos_ring = ((r - pos_ring) & (LZS_N - 1)) - 1;
-            *pak++ = ((len_ring - LZS_THRESHOLD - 1) << 4) | (pos_ring >> 8);
-            *pak++ = pos_ring & 0xFF;
+            st->pos_ring = ((r - st->pos_ring) & (LZS_N - 1)) - 1;
+            *pak++ = ((st->len_ring - LZS_THRESHOLD - 1) << 4) | (st->pos_ring >> 8);
+            *pak++ = st->pos_ring & 0xFF;
         } else {
-            len_ring = 1;
-            *pak++ = ring[r];
+            st->len_ring = 1;
+            *pak++ = st->ring[r];
         }
 
-        len_tmp = len_ring;
+        len_tmp = st->len_ring;
         for (i = 0; i < len_tmp; i++) {
             if (raw == raw_end) break;
-            LZS_DeleteNode(s);
-            ring[s] = *raw++;
-            if (s < LZS_F - 1) ring[s + LZS_N] = ring[s];
+            LZS_DeleteNode(st, s);
+            st->ring[s] = *raw++;
+            if (s < LZS_F - 1) st->ring[s + LZS_N] = st->ring[s];
             s = (s + 1) & (LZS_N - 1);
             r = (r + 1) & (LZS_N - 1);
-            LZS_InsertNode(r);
+            LZS_InsertNode(st, r);
         }
         while (i++ < len_tmp) {
-            LZS_DeleteNode(s);
+            LZS_DeleteNode(st, s);
             s = (s + 1) & (LZS_N - 1);
             r = (r + 1) & (LZS_N - 1);
-            if (--len) LZS_InsertNode(r);
+            if (--len) LZS_InsertNode(st, r);
         }
     }
 
-    *new_len = pak - pak_buffer;
+    return(pak - pak_buffer);
+}
+
+/*----------------------------------------------------------------------------*/
+int LZS_Decode(const unsigned char *pak_buffer, Py_ssize_t pak_len, unsigned char *raw_buffer, Py_ssize_t raw_len) {
+    const unsigned char *pak, *pak_end;
+    unsigned char       *raw, *raw_end;
+    unsigned int         pos, len;
+    unsigned char        flags, mask;
+
+    pak = pak_buffer;
+    pak_end = pak_buffer + pak_len;
+    raw = raw_buffer;
+    raw_end = raw_buffer + raw_len;
+
+    flags = mask = 0;
+
+    while (raw < raw_end) {
+        if (!(mask >>= LZS_SHIFT)) {
+            if (pak == pak_end) return LZS_ERR_TRUNCATED;
+            flags = *pak++;
+            mask = LZS_MASK;
+        }
+
+        if (!(flags & mask)) {
+            if (pak == pak_end) return LZS_ERR_TRUNCATED;
+            *raw++ = *pak++;
+        } else {
+            if (pak_end - pak < 2) return LZS_ERR_TRUNCATED;
+            pos = (*pak++ << 8);
+            pos |= *pak++;
+            len = (pos >> 12) + LZS_THRESHOLD + 1;
+            pos = (pos & 0xFFF) + 1;
+            if (pos > (unsigned int)(raw - raw_buffer)) return LZS_ERR_DISPLACEMENT;
+            if (len > (unsigned int)(raw_end - raw)) return LZS_ERR_OVERRUN;
+            /* byte by byte on purpose, the source may overlap the destination */
+            while (len--) {
+                *raw = *(raw - pos);
+                raw++;
+            }
+        }
+    }
 
-    return(pak_buffer);
+    return LZS_OK;
 }
 
 /*----------------------------------------------------------------------------*/
-void LZS_InitTree(void) {
+void LZS_InitTree(LZS_State *st) {
     int i;
 
     for (i = LZS_N + 1; i <= LZS_N + 256; i++)
-        rson[i] = LZS_NIL;
+        st->rson[i] = LZS_NIL;
 
     for (i = 0; i < LZS_N; i++)
-        dad[i] = LZS_NIL;
+        st->dad[i] = LZS_NIL;
 }
 
 /*----------------------------------------------------------------------------*/
-void LZS_InsertNode(int r) {
+void LZS_InsertNode(LZS_State *st, int r) {
     unsigned char *key;
     int                        i, p, cmp, prev;
 
     prev = (r - 1) & (LZS_N - 1);
 
     cmp = 1;
-    len_ring = 0;
+    st->len_ring = 0;
 
-    key = &ring[r];
+    key = &st->ring[r];
     p = LZS_N + 1 + key[0];
 
-    rson[r] = lson[r] = LZS_NIL;
+    st->rson[r] = st->lson[r] = LZS_NIL;
 
     for ( ; ; ) {
         if (cmp >= 0) {
-            if (rson[p] != LZS_NIL) p = rson[p];
-            else                  { rson[p] = r; dad[r] = p; return; }
+            if (st->rson[p] != LZS_NIL) p = st->rson[p];
+            else                  { st->rson[p] = r; st->dad[r] = p; return; }
         } else {
-            if (lson[p] != LZS_NIL) p = lson[p];
-            else                  { lson[p] = r; dad[r] = p; return; }
+            if (st->lson[p] != LZS_NIL) p = st->lson[p];
+            else                  { st->lson[p] = r; st->dad[r] = p; return; }
         }
 
         for (i = 1; i < LZS_F; i++)
-            if ((cmp = key[i] - ring[p + i])) break;
+            if ((cmp = key[i] - st->ring[p + i])) break;
 
-        if (i > len_ring) {
+        if (i > st->len_ring) {
             if ((p != prev)) {
-                pos_ring = p;
-                if ((len_ring = i) == LZS_F) break;
+                st->pos_ring = p;
+                if ((st->len_ring = i) == LZS_F) break;
             }
         }
     }
 
-    dad[r] = dad[p]; lson[r] = lson[p]; rson[r] = rson[p];
+    st->dad[r] = st->dad[p]; st->lson[r] = st->lson[p]; st->rson[r] = st->rson[p];
 
-    dad[lson[p]] = r; dad[rson[p]] = r;
+    st->dad[st->lson[p]] = r; st->dad[st->rson[p]] = r;
 
-    if (rson[dad[p]] == p) rson[dad[p]] = r;
-    else                   lson[dad[p]] = r;
+    if (st->rson[st->dad[p]] == p) st->rson[st->dad[p]] = r;
+    else                           st->lson[st->dad[p]] = r;
 
-    dad[p] = LZS_NIL;
+    st->dad[p] = LZS_NIL;
 }
 
 /*----------------------------------------------------------------------------*/
-void LZS_DeleteNode(int p) {
+void LZS_DeleteNode(LZS_State *st, int p) {
     int q;
 
-    if (dad[p] == LZS_NIL) return;
+    if (st->dad[p] == LZS_NIL) return;
 
-    if (rson[p] == LZS_NIL) {
-        q = lson[p];
-    } else if (lson[p] == LZS_NIL) {
-        q = rson[p];
+    if (st->rson[p] == LZS_NIL) {
+        q = st->lson[p];
+    } else if (st->lson[p] == LZS_NIL) {
+        q = st->rson[p];
     } else {
-        q = lson[p];
-        if (rson[q] != LZS_NIL) {
+        q = st->lson[p];
+        if (st->rson[q] != LZS_NIL) {
             do {
-                q = rson[q];
-            } while (rson[q] != LZS_NIL);
+                q = st->rson[q];
+            } while (st->rson[q] != LZS_NIL);
 
-            rson[dad[q]] = lson[q];
-            dad[lson[q]] = dad[q];
-            lson[q]      = lson[p];
-            dad[lson[p]] = q;
+            st->rson[st->dad[q]] = st->lson[q];
+            st->dad[st->lson[q]] = st->dad[q];
+            st->lson[q]          = st->lson[p];
+            st->dad[st->lson[p]] = q;
         }
 
-        rson[q] = rson[p]; dad[rson[p]] = q;
+        st->rson[q] = st->rson[p]; st->dad[st->rson[p]] = q;
     }
 
-    dad[q] = dad[p];
+    st->dad[q] = st->dad[p];
 
-    if (rson[dad[p]] == p) rson[dad[p]] = q;
-    else                   lson[dad[p]] = q;
+    if (st->rson[st->dad[p]] == p) st->rson[st->dad[p]] = q;
+    else                           st->lson[st->dad[p]] = q;
 
-    dad[p] = LZS_NIL;
+    st->dad[p] = LZS_NIL;
 }
@@ -17,6 +17,7 @@
 /*--  along with this program. If not, see <http://www.gnu.org/licenses/>.  --*/
 /*----------------------------------------------------------------------------*/
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include "nlzss3.h"
 
@@ -30,33 +31,209 @@ static PyObject *pynlzss_error;
  * module methods
  */
 
+static int pynlzss_check_raw_size(Py_buffer *in)
+{
+	if (in->len > RAW_MAXIM) {
+		PyErr_Format(PyExc_ValueError, "Buffer too large for LZ10: %zd bytes, at most %d allowed", in->len, RAW_MAXIM);
+		return -1;
+	}
+	return 0;
+}
+
+static Py_ssize_t pynlzss_encode(Py_buffer *in, unsigned char *outbuf)
+{
+	Py_ssize_t outsize;
+
+	Py_BEGIN_ALLOW_THREADS
+	outsize = LZSS_Compress(in->buf, in->len, outbuf);
+	Py_END_ALLOW_THREADS
+
+	if (outsize < 0)
+		PyErr_NoMemory();
+	return outsize;
+}
+
 static PyObject *pynlzss_compress(PyObject *m, PyObject *args, PyObject *kw)
 {
 	static char *pynlzss_kwlist[] = {"buffer", NULL };
-	char *outbuf = NULL, *buf = NULL;
-	int insize = 0;
-	Py_ssize_t outsize = 0;
+	Py_buffer in;
+	Py_ssize_t outsize;
+	PyObject *retval = NULL;
 
-	if (!PyArg_ParseTupleAndKeywords(args, kw, "y#", pynlzss_kwlist, &buf, &insize))
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "y*", pynlzss_kwlist, &in))
 		return NULL;
 
-	outbuf = LZSS_Compress(buf, insize, &outsize);
+	if (pynlzss_check_raw_size(&in) < 0)
+		goto done;
 
-	if (!outbuf) {
-		PyErr_SetString(pynlzss_error, "Failed to process LZSS file");
+	/* compress straight into the bytes object, then shrink it to size */
+	retval = PyBytes_FromStringAndSize(NULL, LZS_BOUND(in.len));
+	if (!retval)
+		goto done;
+
+	outsize = pynlzss_encode(&in, (unsigned char *)PyBytes_AS_STRING(retval));
+	if (outsize < 0)
+		Py_CLEAR(retval);
+	else
+		_PyBytes_Resize(&retval, outsize);
+
+done:
+	PyBuffer_Release(&in);
+	return retval;
+}
+
+static PyObject *pynlzss_compress_into(PyObject *m, PyObject *args, PyObject *kw)
+{
+	static char *pynlzss_kwlist[] = {"buffer", "out", NULL };
+	Py_buffer in, out;
+	Py_ssize_t outsize;
+	PyObject *retval = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "y*w*", pynlzss_kwlist, &in, &out))
 		return NULL;
+
+	if (pynlzss_check_raw_size(&in) < 0)
+		goto done;
+
+	if (out.len < LZS_BOUND(in.len)) {
+		PyErr_Format(PyExc_ValueError, "Output buffer too small: %zd bytes needed, %zd available", (Py_ssize_t)LZS_BOUND(in.len), out.len);
+		goto done;
 	}
 
-	PyObject *retval = PyBytes_FromStringAndSize(outbuf, outsize);
-	PyMem_Free(outbuf);
+	outsize = pynlzss_encode(&in, out.buf);
+	if (outsize >= 0)
+		retval = PyLong_FromSsize_t(outsize);
 
+done:
+	PyBuffer_Release(&out);
+	PyBuffer_Release(&in);
+	return retval;
+}
+
+static PyObject *pynlzss_compress_bound(PyObject *m, PyObject *args, PyObject *kw)
+{
+	static char *pynlzss_kwlist[] = {"size", NULL };
+	Py_ssize_t size;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "n", pynlzss_kwlist, &size))
+		return NULL;
+
+	if (size < 0 || size > RAW_MAXIM) {
+		PyErr_Format(PyExc_ValueError, "Size out of range for LZ10: %zd", size);
+		return NULL;
+	}
+
+	return PyLong_FromSsize_t(LZS_BOUND(size));
+}
+
+static Py_ssize_t pynlzss_decompressed_size(Py_buffer *in)
+{
+	const unsigned char *header = in->buf;
+
+	if (in->len < 4 || header[0] != CMD_CODE_10) {
+		PyErr_SetString(pynlzss_error, "Not LZ10-compressed data");
+		return -1;
+	}
+
+	return header[1] | (header[2] << 8) | (header[3] << 16);
+}
+
+static int pynlzss_decode(Py_buffer *in, unsigned char *outbuf, Py_ssize_t outsize)
+{
+	int res;
+
+	Py_BEGIN_ALLOW_THREADS
+	res = LZS_Decode((const unsigned char *)in->buf + 4, in->len - 4, outbuf, outsize);
+	Py_END_ALLOW_THREADS
+
+	switch (res) {
+	case LZS_OK:
+		return 0;
+	case LZS_ERR_TRUNCATED:
+		PyErr_SetString(pynlzss_error, "Compressed data is truncated");
+		break;
+	case LZS_ERR_DISPLACEMENT:
+		PyErr_SetString(pynlzss_error, "Back-reference before the start of the data");
+		break;
+	default:
+		PyErr_SetString(pynlzss_error, "Decompressed size does not match the expected size");
+		break;
+	}
+	return -1;
+}
+
+static PyObject *pynlzss_decompress(PyObject *m, PyObject *args, PyObject *kw)
+{
+	static char *pynlzss_kwlist[] = {"buffer", NULL };
+	Py_buffer in;
+	Py_ssize_t outsize;
+	PyObject *retval = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "y*", pynlzss_kwlist, &in))
+		return NULL;
+
+	outsize = pynlzss_decompressed_size(&in);
+	if (outsize < 0)
+		goto done;
+
+	retval = PyBytes_FromStringAndSize(NULL, outsize);
+	if (!retval)
+		goto done;
+
+	if (pynlzss_decode(&in, (unsigned char *)PyBytes_AS_STRING(retval), outsize) < 0)
+		Py_CLEAR(retval);
+
+done:
+	PyBuffer_Release(&in);
+	return retval;
+}
+
+static PyObject *pynlzss_decompress_into(PyObject *m, PyObject *args, PyObject *kw)
+{
+	static char *pynlzss_kwlist[] = {"buffer", "out", NULL };
+	Py_buffer in, out;
+	Py_ssize_t outsize;
+	PyObject *retval = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kw, "y*w*", pynlzss_kwlist, &in, &out))
+		return NULL;
+
+	outsize = pynlzss_decompressed_size(&in);
+	if (outsize < 0)
+		goto done;
+
+	if (out.len < outsize) {
+		PyErr_Format(PyExc_ValueError, "Output buffer too small: %zd bytes needed, %zd available", outsize, out.len);
+		goto done;
+	}
+
+	if (pynlzss_decode(&in, out.buf, outsize) == 0)
+		retval = PyLong_FromSsize_t(outsize);
+
+done:
+	PyBuffer_Release(&out);
+	PyBuffer_Release(&in);
 	return retval;
 }
 
 static PyMethodDef pynlzss_methods[] = {
 	{ "compress", (PyCFunction)pynlzss_compress,
 	  METH_VARARGS | METH_KEYWORDS,
-	  "Compress a bytes using the LZSS algorithm." },
+	  "Compress any contiguous buffer using the LZSS algorithm, returns a bytes." },
+	{ "compress_into", (PyCFunction)pynlzss_compress_into,
+	  METH_VARARGS | METH_KEYWORDS,
+	  "Compress any contiguous buffer into a writable buffer of at least compress_bound(len(buffer)) bytes.\n"
+	  "Returns the number of bytes written." },
+	{ "compress_bound", (PyCFunction)pynlzss_compress_bound,
+	  METH_VARARGS | METH_KEYWORDS,
+	  "Worst case size of the compressed data for an input of the given size." },
+	{ "decompress", (PyCFunction)pynlzss_decompress,
+	  METH_VARARGS | METH_KEYWORDS,
+	  "Decompress LZ10-compressed data (header included) to a bytes." },
+	{ "decompress_into", (PyCFunction)pynlzss_decompress_into,
+	  METH_VARARGS | METH_KEYWORDS,
+	  "Decompress LZ10-compressed data (header included) into a writable buffer.\n"
+	  "Returns the number of bytes written." },
 	{ NULL, NULL, 0, NULL }
 };
 